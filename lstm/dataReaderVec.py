@@ -2,19 +2,38 @@ import torch
 import numpy as np
 import random
 from torch.utils.data import Dataset
-from collections import defaultdict, OrderedDict
+from collections import OrderedDict
+from utilities.augmentation import openCorpus
+from utilities.labelStore import buildLabelStore
+
+# lines of the label files written by utilities.ndjsonVectorisation
+LABEL_FILE_FIELDS = ['property_type', 'exclusive_solum', 'common_solum', 'additional_info']
 
 class VectorDataset(Dataset):
 
-    def __init__(self, file_paths, labels, seq_dim, batch_size=1):
+    # file_paths is either a list of vector files (with a label file each) or the directory of a corpus converted by
+    # utilities.conversion, which holds the labels itself; the documents of a converted corpus are read (or gathered
+    # from the dictionary and augmented) when they are drawn. Samples are labelled with label_field.
+    def __init__(self, file_paths, labels, seq_dim, batch_size=1, dict_file=None, label_field='exclusive_solum'):
     
-        self.file_paths = file_paths
-        self.num_files  = len(file_paths)
-        self.batch_size = batch_size
-        
-        self.keywords   = self.getKeywords()
-        self.labels     = self.getLabelsFromFiles(labels)    
-        self.files      = self.readFiles()    
+        self.file_paths  = file_paths
+        self.batch_size  = batch_size
+        self.label_field = label_field
+        self.keywords    = self.getKeywords()
+
+        if isinstance(file_paths, str):
+            self.corpus      = openCorpus(file_paths, dict_file)
+            self.num_files   = len(self.corpus)
+            self.label_store = self.corpus.label_store
+            self.files       = None
+        else:
+            self.corpus      = None
+            self.num_files   = len(file_paths)
+            self.label_store = self.getLabelsFromFiles(labels)
+            self.files       = self.readFiles()
+
+        # label id of every document, -1 for labels that are not in labels.txt
+        self.label_ids  = self.labelIds()
 
         # print label distribution
         self.lbl_hist   = self.labelHistogram()
@@ -36,14 +55,20 @@ class VectorDataset(Dataset):
         
     def getLabelsFromFiles(self, files):
     
-        labels = list() #list of lists
+        labels = list() #list of dicts
         for file in files:
             lines = list()
             for line in open(file, encoding="utf8"):
                 lines.append(line.replace('\n',''))    
-            labels.append(lines)
+            labels.append(dict(zip(LABEL_FILE_FIELDS, lines)))
     
-        return labels
+        return buildLabelStore(labels)
+
+
+    def labelIds(self):
+        # the extra -1 at the end is picked by missing fields (string id -1)
+        lookup = np.array([self.keywords.get(string, -1) for string in self.label_store.strings] + [-1], dtype=np.int64)
+        return lookup[self.label_store.column(self.label_field)]
         
         
     def readFiles(self):
@@ -67,22 +92,43 @@ class VectorDataset(Dataset):
         return allfiles   
         
     
+    # new keyword permutations of an augmented corpus
+    def setEpoch(self, epoch):
+        if hasattr(self.corpus, 'setEpoch'):
+            self.corpus.setEpoch(epoch)
+
+
+    def document(self, index):
+        if self.corpus is not None:
+            return self.corpus.document(index)
+        return self.files[index]
+
+
+    # keyword channel of a document, all -1 if the corpus has none
+    def keywordIds(self, index, length):
+        if self.corpus is not None and self.corpus.keyword_channel:
+            return self.corpus.keywordIds(index)
+        return np.full((length,), -1, dtype=np.int64)
+
+
     def printLabelDictionary(self, lbl_hist):
     
+        descriptions = {label: description for description, label in self.keywords.items()}
+
         print("| ---- Label Dictionary ----  |")
         print("|                             |")
         for item in lbl_hist:
-            print("| Label: {:2d}, Description: {} ".format(item, self.labels[item]))
+            print("| Label: {:2d}, Description: {} ".format(item, descriptions[item]))
         print("|                             |")      
 
 
     def labelHistogram(self):
-        lbl_hist = defaultdict(int)
-        for label in self.labels:
-            lbl = self.keywords[label[1]]
-            lbl_hist[lbl] += 1
+        counts   = np.bincount(self.label_ids[self.label_ids >= 0], minlength=len(self.keywords))
+        lbl_hist = OrderedDict((int(lbl), int(counts[lbl])) for lbl in np.flatnonzero(counts))
 
-        lbl_hist = OrderedDict(sorted(lbl_hist.items()))
+        # documents with a frequent label are drawn less often, documents without a known label never
+        self.draw_prob = np.where(self.label_ids >= 0, 1.0 - counts[np.maximum(self.label_ids, 0)] / self.num_files,
+                                  -1.0)
         
         print("| ---- Label Frequency ----  |")
         print("|                            |")
@@ -100,13 +146,9 @@ class VectorDataset(Dataset):
         threshold  = random.uniform(0, 0.95)
     
         while True:
-            index      = random.randint(-1, self.num_files-1)
-            label_str  = self.labels[index][1]
-            label      = self.keywords[label_str]
-            
-            draw_prob  = 1.0 - float(self.lbl_hist[label]/self.num_files)
-            
-            if draw_prob > threshold:
+            index      = random.randint(0, self.num_files-1)
+
+            if self.draw_prob[index] > threshold:
                 return index
                 
 
@@ -132,10 +174,11 @@ class VectorDataset(Dataset):
         '''
         
         index      = self.drawSample()
-        vectorfile = self.files[index]
-        label_str  = self.labels[index][1]
-        label      = self.keywords[label_str]
+        vectorfile = self.document(index)
+        keywords   = self.keywordIds(index, len(vectorfile))
+        label      = self.label_ids[index]
 
 
-        return torch.tensor([np.asarray(vectorfile)]).float(), torch.tensor(label).long()
+        return torch.tensor([np.asarray(vectorfile)]).float(), torch.tensor([np.asarray(keywords)]).long(), \
+               torch.tensor(label).long()
 
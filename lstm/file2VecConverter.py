@@ -1,6 +1,8 @@
 import torch
 import numpy as np
 from utilities import utilities
+from utilities.vectorStore import readVectorStore, writeVectors
+from utilities.subword import readSubwordBuckets
 from tqdm import tqdm
 import sys
 
@@ -16,11 +18,12 @@ class File2VecConverter:
         self.dict_file_path = dict_file_path
         self.unknown_vec    = unknown_vec
 
-        self.vector_dict, params = utilities.readVectorsDict(dict_file_path)
+        self.vector_store = readVectorStore(dict_file_path)
+        self.buckets      = readSubwordBuckets(dict_file_path) if unknown_vec == utilities.Vec.subwordVec else None
 
-        self.unique_vectors = params[0]
-        self.vector_size    = params[1]
-        self.num_vec_req    = params[2]
+        self.unique_vectors = self.vector_store.num_vectors
+        self.vector_size    = self.vector_store.vector_size
+        self.num_vec_req    = self.vector_store.max_num_words_file
 
         self.zeroVector = self.zeroVector()
 
@@ -29,13 +32,7 @@ class File2VecConverter:
 
 
     def zeroVector(self):
-        string = "["
-        for i in range(0, self.vector_size):
-            string = string + "'0.0'"
-            if i < self.vector_size-1:
-                string = string + ", "
-
-        return string + "]"
+        return np.zeros((self.vector_size,), dtype=np.float32)
 
 
     # returns the vector in form of a parsed string, which is then used as the reverse ditionary key
@@ -61,9 +58,7 @@ class File2VecConverter:
             vectors = self.vecToLine(file)
 
             with open(vec_files[count], 'w') as f:
-
-                for i in range(0,len(vectors)):
-                    f.write(str(vectors[i]).replace("'", "").replace(", ", " ").replace("[", "").replace("]", "")+'\n')
+                writeVectors(f, vectors)
 
             count += 1
 
@@ -83,12 +78,12 @@ class File2VecConverter:
             if len(line) > 1:
                 for word in line:
                     if len(word) > 0:
-                        if word in self.vector_dict:
-                            vectors.append(self.vector_dict[word])
+                        if word in self.vector_store:
+                            vectors.append(self.vector_store[word])
                             self.total_num_words = self.total_num_words + 1
                         else:
-                            replacement = self.unknownWordReplacement()
-                            if replacement:
+                            replacement = self.unknownWordReplacement(word)
+                            if replacement is not None:
                                 vectors.append(replacement)
                             self.num_unknown_words = self.num_unknown_words + 1
 
@@ -96,8 +91,10 @@ class File2VecConverter:
 
 
     # decide how to come up with a vector for unknown words
-    def unknownWordReplacement(self):
+    def unknownWordReplacement(self, word):
         if self.unknown_vec == utilities.Vec.zeroVec:
             return self.zeroVector
         if self.unknown_vec == utilities.Vec.skipVec:
             return None
+        if self.unknown_vec == utilities.Vec.subwordVec:
+            return self.buckets.vectors([word], self.vector_size)[0]
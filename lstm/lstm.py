@@ -6,7 +6,7 @@ from torch.nn import init
 
 class LSTMModel(nn.Module):
 
-    def __init__(self, input_dim, hidden_dim, layer_dim, output_dim, bias=True):
+    def __init__(self, input_dim, hidden_dim, layer_dim, output_dim, bias=True, num_keywords=0, keyword_dim=4):
         super(LSTMModel, self).__init__()
         # Hidden dimensions
         self.hidden_dim = hidden_dim
@@ -14,12 +14,21 @@ class LSTMModel(nn.Module):
         # Number of hidden layers
         self.layer_dim = layer_dim
 
+        # keyword channel: keyword ids (-1 for none) are embedded and appended to the input vectors
+        self.num_keywords = num_keywords
+        if num_keywords > 0:
+            self.keyword_embedding = nn.Embedding(num_keywords + 1, keyword_dim, padding_idx=0)
+            input_dim += keyword_dim
+
         self.lstm = LSTMCell(input_dim, hidden_dim, layer_dim)
 
         self.fc = nn.Linear(hidden_dim, output_dim)
 
 
-    def forward(self, x):
+    def forward(self, x, keywords=None):
+
+        if self.num_keywords > 0:
+            x = torch.cat([x.float(), self.keyword_embedding(keywords + 1)], dim=2)
 
         if torch.cuda.is_available():
             h0 = Variable(torch.zeros(self.layer_dim, x.size(0), self.hidden_dim).cuda())
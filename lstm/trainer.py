@@ -9,7 +9,7 @@ from utilities.utilities import weightInit
 class LSTMTrainer:
 
     def __init__(self, train_files, train_labels, test_files, test_labels, learning_rate, iterations_per_epoch,
-                 input_dim, seq_dim, hidden_dim, layer_dim, output_dim):
+                 input_dim, seq_dim, hidden_dim, layer_dim, output_dim, num_keywords=0, keyword_dim=4):
 
         self.input_dim  = input_dim
         self.seq_dim    = seq_dim
@@ -19,7 +19,9 @@ class LSTMTrainer:
 
         self.iterations_per_epoch = iterations_per_epoch
 
-        self.model = LSTMModel(input_dim, hidden_dim, layer_dim, output_dim)
+        # with num_keywords the model embeds the keyword channel of the dictionary, input_dim is the dense part only
+        self.model = LSTMModel(input_dim, hidden_dim, layer_dim, output_dim, num_keywords=num_keywords,
+                               keyword_dim=keyword_dim)
 
         self.criterion  = nn.CrossEntropyLoss()
 
@@ -70,17 +72,19 @@ class LSTMTrainer:
         if test == False:
             loader = self.train_loader
 
-        for j, (vector_doc, label) in enumerate(loader):
+        for j, (vector_doc, keywords, label) in enumerate(loader):
         
             if torch.cuda.is_available():
                 vector_doc = Variable(vector_doc.view(len(vector_doc), -1, self.input_dim).cuda())
+                keywords = keywords.view(len(keywords), -1).cuda()
                 label = Variable(label.cuda())
             else:
                 vector_doc = Variable(vector_doc.view(len(vector_doc), -1, self.input_dim))
+                keywords = keywords.view(len(keywords), -1)
                 label = Variable(label)
 
             # Forward pass only to get logits/output
-            outputs = self.model(vector_doc)
+            outputs = self.model(vector_doc, keywords)
 
             # Get predictions from the maximum value
             _, predicted = torch.max(outputs, 0)
@@ -116,13 +120,17 @@ class LSTMTrainer:
 
             avg_loss = 0.0
 
-            for i, (vector_doc, label) in enumerate(self.train_loader):
+            self.train_loader.setEpoch(epoch)
+
+            for i, (vector_doc, keywords, label) in enumerate(self.train_loader):
 
                 if torch.cuda.is_available():
                     vector_doc = Variable(vector_doc.view(len(vector_doc), -1, self.input_dim).cuda())
+                    keywords = keywords.view(len(keywords), -1).cuda()
                     label = Variable(label.cuda())
                 else:
                     vector_doc = Variable(vector_doc.view(len(vector_doc), -1, self.input_dim))
+                    keywords = keywords.view(len(keywords), -1)
                     label = Variable(label)
 
                 # Clear gradients w.r.t. parameters
@@ -130,7 +138,7 @@ class LSTMTrainer:
 
                 # Forward pass to get output/logits
                 # outputs.size() --> 1, 3
-                outputs = self.model(vector_doc)
+                outputs = self.model(vector_doc, keywords)
 
                 # Calculate Loss: softmax --> cross entropy loss
                 loss = self.criterion(outputs.unsqueeze(dim=0), label.unsqueeze(dim=0))
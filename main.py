@@ -3,8 +3,9 @@ import time
 import ndjson
 import jsonlines
 from utilities.utilities import Mode, weightInit, Vec, labelType
-from utilities import utilities, plotgraphs, paths, display, duplicator
+from utilities import utilities, plotgraphs, paths, display, duplicator, benchmark, conversion
 from word2vec.trainer import Word2VecTrainer
+from word2vec.word2vec import SkipGramModel
 from lstm.trainer import LSTMTrainer
 from similarity.cosine import CosineSimilarity
 
@@ -30,6 +31,13 @@ if __name__ == '__main__':
         exit(0)
     
     
+    if mode == Mode.benchmark:
+        benchmark.benchmarkTokenizer(ros.docfile_house)
+        #benchmark.benchmarkLossModes(ros.keyword_path, ros.docfile_house)
+        #benchmark.benchmarkCompiledStep(ros.keyword_path, ros.docfile_house)
+        exit(0)
+
+
     if mode == Mode.word2vec:
     
         # word2vec training parameters
@@ -39,44 +47,53 @@ if __name__ == '__main__':
                               batch_size=32,
                               window_size=7,
                               initial_lr=0.01,
-                              min_count=1)
+                              min_count=1,
+                              keyword_channel=True,
+                              checkpoint_path=ros.w2v_checkpoint,
+                              validation_fraction=0.1,
+                              patience=3)
                               
         # train standard word2vec -> train function outputs dictionary at the end
         loading  = time.time()
         parcel_0 = w2v.train(ros.docfile_house, ros.dict_file, num_epochs=100)
+        #parcel_0 = w2v.trainHogwild(ros.docfile_house, ros.dict_file, num_epochs=100, num_processes=8)
+        #parcel_0 = w2v.resume(ros.docfile_house, ros.dict_file, ros.w2v_checkpoint, num_epochs=100)
+        #parcel_0 = w2v.update(new_documents, ros.dict_file, saved_model_path, num_passes=5)
         
         # write training results (learning curve) to csv
-        utilities.resultsToCSV(parcel_0, w2v.toString(), ros.w2v_csv_lss_dir)
+        utilities.resultsToCSV(parcel_0, w2v.toString(), ros.w2v_csv_lss_dir, note=w2v.stopNote())
         
         # save model if specified
         if save_model:
             path = ros.w2v_model_param + w2v.toString() + '_date_' + utilities.timeStampedFileName()
-            torch.save(w2v.skip_gram_model.state_dict(), path)
+            w2v.saveModel(path)
 
 
     if mode == Mode.conversion:
         # convert documents into vector representation and save to different file location
         # utilities.ndjsonVectorisation(ros.training, ros.vec_files_train, ros.vec_files_train_labels, ros.dict_file, unknown_vec=Vec.skipVec)
-        duplication = duplicator.Duplicate(ros.docfile_flats, ros.docfile_duplicate, 31)    
+        duplication = duplicator.Duplicate(ros.docfile_flats, ros.converted_train, 31)
         duplication.convert(100, ros.dict_file, labelSelection=labelType.exclusive_strata)
         
-        utilities.ndjsonVectorisation(ros.testing,  ros.vec_files_test,  ros.vec_files_test_labels  ,ros.dict_file, unknown_vec=Vec.skipVec)
+        # utilities.ndjsonVectorisation(ros.testing,  ros.vec_files_test,  ros.vec_files_test_labels  ,ros.dict_file, unknown_vec=Vec.skipVec)
+        conversion.convertCorpus(ros.testing, ros.converted_test, ros.dict_file, unknown_vec=Vec.skipVec, token_ids=True)
         exit(0)
 
     if mode == Mode.lstm:
 
         # lstm training parameters
-        lstm = LSTMTrainer(ros.vec_files_test,
-                           ros.vec_files_test_labels,
-                           ros.vec_files_train,
-                           ros.vec_files_train_labels,
+        lstm = LSTMTrainer(ros.converted_test,
+                           None,
+                           ros.converted_train,
+                           None,
                            learning_rate=0.002,
                            iterations_per_epoch=200,
-                           input_dim=61,
+                           input_dim=50,
                            seq_dim=6,
                            hidden_dim=30,
                            layer_dim=1,
-                           output_dim=13)
+                           output_dim=13,
+                           num_keywords=len(SkipGramModel.readKeywords(ros.keyword_path)))
 
         # train lstm
         loading = time.time()
@@ -3,6 +3,7 @@ import math
 from numpy import dot
 from numpy.linalg import norm
 from utilities import utilities
+from utilities.vectorStore import readVectorStore
 import scipy.misc as smp
 from tqdm import tqdm
 
@@ -14,7 +15,7 @@ class CosineSimilarity():
         self.dict_path = dict_path
         self.key_path  = None
 
-        self.all_dictionary, _ = utilities.readVectorsDict(dict_path)
+        self.all_dictionary    = readVectorStore(dict_path)
         self.subset_dictionary = self.subsetDictFromDocs()
         self.key_dictionary    = dict()
 
@@ -65,8 +66,8 @@ class CosineSimilarity():
     def itemToVec(self, key0, key1):
         item0 = self.subset_dictionary[key0]
         item1 = self.subset_dictionary[key1]
-        vec0  = np.array(item0).astype(np.float)
-        vec1  = np.array(item1).astype(np.float)
+        vec0  = np.asarray(item0, dtype=np.float64)
+        vec1  = np.asarray(item1, dtype=np.float64)
         return vec0, vec1
 
 
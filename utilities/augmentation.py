@@ -0,0 +1,142 @@
+import os
+import json
+import numpy as np
+from utilities.convertedCorpus import ConvertedCorpus, readMeta, writeMeta
+
+''' Keyword augmentation applied when a sample is drawn. Instead of writing duplicate_factor converted copies of every
+    document, the originals are converted once (as dictionary rows, see utilities.conversion) and copy k of a document
+    is produced on the fly by replacing every keyword with its image under the k-th permutation of its keyword group
+    (styles are exchanged among styles, colours among colours). Copy 0 is the original document.
+    The permutations are drawn with Sattolo's algorithm, which gives a random cyclic permutation in O(n) without
+    rejection: every keyword of a group is moved. They are derived from a seed, so only the seed and the keyword groups
+    are stored (augmentation.json next to meta.json); a new epoch can draw new permutations from seed + epoch.
+    A corpus is only augmented if meta.json says so: every conversion writes it with augmented false and removes an
+    old augmentation.json, writeAugmentation is the only thing that sets it.
+'''
+
+AUGMENTATION_FILE = 'augmentation.json'
+
+
+# random cyclic permutation of range(n), a derangement for n > 1
+def sattolo(n, rng):
+
+    permutation = np.arange(n)
+    for i in range(n - 1, 0, -1):
+        j = rng.integers(0, i)
+        permutation[i], permutation[j] = permutation[j], permutation[i]
+
+    return permutation
+
+
+# one permutation per copy, copy 0 is the identity
+def keywordPermutations(num_keywords, num_copies, rng):
+
+    permutations = np.zeros((num_copies, num_keywords), dtype=np.int64)
+    for copy in range(0, num_copies):
+        permutations[copy] = np.arange(num_keywords) if copy == 0 else sattolo(num_keywords, rng)
+
+    return permutations
+
+
+class KeywordAugmentation:
+
+    # groups are lists of keywords that are exchanged among each other; keywords missing from the dictionary are left
+    # out of their group
+    def __init__(self, vector_store, groups, num_copies, seed=0):
+
+        self.num_copies = num_copies
+        self.seed       = seed
+        self.groups     = [[vector_store.word2row[word] for word in group if word in vector_store] for group in groups]
+
+        # position of every dictionary row in the concatenated groups, -1 for rows that are no keyword
+        self.rows          = np.array([row for group in self.groups for row in group], dtype=np.int64)
+        self.keyword_index = np.full((vector_store.num_vectors,), -1, dtype=np.int64)
+        self.keyword_index[self.rows] = np.arange(len(self.rows))
+
+        self.setEpoch(0)
+
+
+    # draw the permutations of all copies for an epoch
+    def setEpoch(self, epoch):
+
+        rng          = np.random.default_rng(self.seed + epoch)
+        permutations = list()
+        start        = 0
+
+        for group in self.groups:
+            permutations.append(keywordPermutations(len(group), self.num_copies, rng) + start)
+            start += len(group)
+
+        self.permutations = np.concatenate(permutations, axis=1) if len(permutations) > 0 else \
+                            np.zeros((self.num_copies, 0), dtype=np.int64)
+
+
+    # dictionary rows of copy k of a document
+    def remap(self, rows, copy):
+
+        if copy == 0 or len(self.rows) == 0:
+            return rows
+
+        rows     = np.array(rows)
+        index    = self.keyword_index[np.maximum(rows, 0)]
+        keywords = (index >= 0) & (rows >= 0)
+
+        rows[keywords] = self.rows[self.permutations[copy][index[keywords]]]
+
+        return rows
+
+
+# store the augmentation of a converted corpus and mark the corpus as augmented
+def writeAugmentation(output_dir, num_copies, seed, groups):
+
+    with open(os.path.join(output_dir, AUGMENTATION_FILE), 'w', encoding="utf8") as f:
+        json.dump({'num_copies': num_copies, 'seed': seed, 'groups': groups}, f)
+
+    meta = readMeta(output_dir)
+    meta['augmented'] = True
+    writeMeta(output_dir, meta)
+
+
+# drop the augmentation of a corpus that is converted again
+def removeAugmentation(output_dir):
+
+    path = os.path.join(output_dir, AUGMENTATION_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class AugmentedCorpus(ConvertedCorpus):
+
+    def __init__(self, output_dir, dict_file=None):
+
+        super().__init__(output_dir, dict_file)
+
+        if not self.token_ids:
+            raise ValueError("{} holds vectors, keywords can only be exchanged in a corpus of token ids".format(
+                output_dir))
+
+        with open(os.path.join(output_dir, AUGMENTATION_FILE), encoding="utf8") as f:
+            config = json.load(f)
+
+        self.augmentation  = KeywordAugmentation(self.vector_store, config['groups'], config['num_copies'],
+                                                 config['seed'])
+        self.num_originals = self.num_documents
+        self.num_documents = self.num_originals * config['num_copies']
+        self.label_store   = self.label_store.tile(config['num_copies'])
+
+
+    def setEpoch(self, epoch):
+        self.augmentation.setEpoch(epoch)
+
+
+    # dictionary rows of copy index // num_originals of the document index % num_originals
+    def documentRows(self, index):
+        copy, index = divmod(index, self.num_originals)
+        return self.augmentation.remap(self.tokens(index), copy)
+
+
+# reader of a converted corpus, with augmentation if it was converted with one
+def openCorpus(output_dir, dict_file=None):
+    if readMeta(output_dir).get('augmented', False):
+        return AugmentedCorpus(output_dir, dict_file)
+    return ConvertedCorpus(output_dir, dict_file)
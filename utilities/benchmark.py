@@ -0,0 +1,199 @@
+import re
+import time
+import ndjson
+import torch
+import numpy as np
+import torch.optim as optim
+from string import punctuation
+from utilities import tokenizer
+from word2vec.trainer import Word2VecTrainer
+from word2vec.word2vec import SkipGramModel
+from word2vec.pairGenerator import concatenatePairs
+
+''' Micro-benchmarks for the hot paths of the pipeline. Benchmarks of exact replacements check that the fast path
+    produces the same result as the reference implementation before reporting timings, benchmarks of alternative
+    training modes report the loss next to the throughput.
+'''
+
+
+# original character by character implementation of parseLine, kept as reference
+def legacyParseLine(line):
+    line = line.lower()
+    line = re.sub(r'\(.*?\)', '', line) #remove special characters
+    line = ''.join([c for c in line if c not in punctuation])
+    line = re.sub(r'[^\x00-\x7f]', r'', line) #remove hex characters
+    return line
+
+
+def legacyTokenizeDocument(document):
+    address    = legacyParseLine(document['address'][0]['prettyPrint'])
+    text_array = legacyParseLine(document['text']).replace(address, 'address').split(' ')
+    return [item for item in text_array if len(item) > 0]
+
+
+# best wall time of a function over a number of repeats
+def timeFunction(function, repeats):
+    best = float('inf')
+    for i in range(0, repeats):
+        start  = time.perf_counter()
+        result = function()
+        best   = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# compare the legacy tokenizer with utilities.tokenizer on a ndjson corpus
+def benchmarkTokenizer(ndjson_file, num_docs=None, repeats=3):
+
+    with open(ndjson_file) as f:
+        documents = ndjson.load(f)
+
+    if num_docs:
+        documents = documents[0:num_docs]
+
+    legacy_time, legacy = timeFunction(lambda: [legacyTokenizeDocument(d) for d in documents], repeats)
+    single_time, single = timeFunction(lambda: [tokenizer.tokenizeDocument(d) for d in documents], repeats)
+    batch_time,  batch  = timeFunction(lambda: tokenizer.tokenizeDocuments(documents), repeats)
+
+    if legacy != single or legacy != batch:
+        raise ValueError("Tokenizer output differs from the legacy parseLine")
+
+    num_tokens = sum(len(tokens) for tokens in legacy)
+
+    print("Tokenized {} documents, {} tokens".format(len(documents), num_tokens))
+    print("Legacy parseLine  {:8.3f} s".format(legacy_time))
+    print("Tokenizer         {:8.3f} s, speedup {:6.1f}x".format(single_time, legacy_time / single_time))
+    print("Tokenizer (batch) {:8.3f} s, speedup {:6.1f}x".format(batch_time,  legacy_time / batch_time))
+
+    return legacy_time, single_time, batch_time
+
+
+# pair batches of the first documents of a word2vec dataset, shared by all modes of a benchmark
+def collectPairBatches(dataset, batch_size, num_batches):
+
+    batches = list()
+    batch   = list()
+
+    for pairs in dataset:
+        batch.append(pairs)
+        if len(batch) == batch_size:
+            pos_u, pos_v = concatenatePairs(batch)
+            batch = list()
+            if len(pos_u) > 1:
+                batches.append((torch.from_numpy(pos_u), torch.from_numpy(pos_v)))
+            if len(batches) == num_batches:
+                break
+
+    return batches
+
+
+# compare per-pair negatives with a pool of negatives shared by the batch: training throughput on CPU and the
+# per-pair negative sampling loss on held-out batches after the same number of steps
+def benchmarkLossModes(keyword_path, corpus_path, shared_negatives=(64, 256, 1024), emb_dimension=50, batch_size=32,
+                       window_size=7, initial_lr=0.01, num_steps=200, num_eval=20):
+
+    trainer = Word2VecTrainer(keyword_path, primary_files=corpus_path, emb_dimension=emb_dimension,
+                              batch_size=batch_size, window_size=window_size, initial_lr=initial_lr)
+    dataset = trainer.initDataset(corpus_path)
+    batches = collectPairBatches(dataset, batch_size, num_steps + num_eval)
+
+    # a small corpus gives fewer batches, the held-out ones are kept and the training steps shortened
+    if len(batches) <= num_eval:
+        raise ValueError("{} gives only {} pair batches, {} are held out".format(corpus_path, len(batches), num_eval))
+
+    train_batches = batches[0:len(batches) - num_eval]
+    eval_batches  = batches[len(batches) - num_eval:]
+
+    rng       = np.random.RandomState(0)
+    eval_negs = [torch.from_numpy(trainer.data.getNegatives(len(u) * trainer.num_negatives, rng)
+                                  .reshape(len(u), trainer.num_negatives)) for u, _ in eval_batches]
+
+    results = list()
+
+    for pool in (0,) + tuple(shared_negatives):
+
+        torch.manual_seed(0)
+        model     = SkipGramModel(keyword_path, trainer.emb_size, emb_dimension)
+        optimizer = optim.SparseAdam(model.parameters(), lr=initial_lr)
+        rng       = np.random.RandomState(0)
+        weight    = trainer.num_negatives / pool if pool > 0 else 1.0
+
+        num_pairs = 0
+        start     = time.perf_counter()
+
+        for pos_u, pos_v in train_batches:
+            if pool > 0:
+                neg_v = torch.from_numpy(trainer.data.getNegatives(pool, rng))
+            else:
+                neg_v = torch.from_numpy(trainer.data.getNegatives(len(pos_u) * trainer.num_negatives, rng)
+                                         .reshape(len(pos_u), trainer.num_negatives))
+            optimizer.zero_grad()
+            loss = model.forward(pos_u, pos_v, neg_v, weight)
+            loss.backward()
+            optimizer.step()
+            num_pairs += len(pos_u)
+
+        elapsed = time.perf_counter() - start
+
+        with torch.no_grad():
+            eval_loss = np.mean([model.forward(u, v, n).item() for (u, v), n in zip(eval_batches, eval_negs)])
+
+        results.append((pool, num_pairs / elapsed, eval_loss))
+
+    print("{} training steps, held-out loss on {} batches".format(len(train_batches), len(eval_batches)))
+    print("| negatives           | pairs per second | held-out loss |")
+    for pool, throughput, eval_loss in results:
+        mode = "{} per pair".format(trainer.num_negatives) if pool == 0 else "{} shared".format(pool)
+        print("| {:19} | {:16.0f} | {:13.4f} |".format(mode, throughput, eval_loss))
+
+    return results
+
+
+# training steps per second of the eager and the compiled loss on CPU, on the same batches and negatives; the first
+# warmup steps are not timed, they include the compilation
+def benchmarkCompiledStep(keyword_path, corpus_path, emb_dimension=50, batch_size=32, window_size=7,
+                          initial_lr=0.01, num_steps=500, warmup=20):
+
+    trainer = Word2VecTrainer(keyword_path, primary_files=corpus_path, emb_dimension=emb_dimension,
+                              batch_size=batch_size, window_size=window_size, initial_lr=initial_lr)
+    dataset = trainer.initDataset(corpus_path)
+    batches = collectPairBatches(dataset, batch_size, num_steps + warmup)
+
+    if len(batches) <= warmup:
+        raise ValueError("The corpus has only {} batches, not enough for {} warmup steps".format(len(batches), warmup))
+
+    rng     = np.random.RandomState(0)
+    batches = [(u, v, torch.from_numpy(trainer.data.getNegatives(len(u) * trainer.num_negatives, rng)
+                                       .reshape(len(u), trainer.num_negatives))) for u, v in batches]
+
+    results = list()
+
+    for compiled in (False, True):
+
+        torch.manual_seed(0)
+        model     = SkipGramModel(keyword_path, trainer.emb_size, emb_dimension)
+        optimizer = optim.SparseAdam(model.parameters(), lr=initial_lr)
+        if compiled:
+            model.compileLoss()
+
+        start = time.perf_counter()
+        total = torch.zeros(())
+
+        for step, (pos_u, pos_v, neg_v) in enumerate(batches):
+            if step == warmup:
+                warmup_time = time.perf_counter() - start
+                start       = time.perf_counter()
+            optimizer.zero_grad()
+            loss = model.forward(pos_u, pos_v, neg_v)
+            loss.backward()
+            optimizer.step()
+            total += loss.detach()
+
+        elapsed = time.perf_counter() - start
+        results.append((compiled, (len(batches) - warmup) / elapsed, warmup_time, total.item() / len(batches)))
+
+    print("| loss     | steps per second | warmup (s) | mean loss |")
+    for compiled, throughput, warmup_time, mean_loss in results:
+        mode = "compiled" if compiled else "eager"
+        print("| {:8} | {:16.0f} | {:10.2f} | {:9.4f} |".format(mode, throughput, warmup_time, mean_loss))
+
+    return results
@@ -0,0 +1,293 @@
+import os
+import sys
+import shutil
+import time
+import numpy as np
+import multiprocessing as mp
+from collections import Counter
+from utilities.utilities import Vec, getTextNdJson, documentVectors
+from utilities.vectorStore import readVectorStore, readKeywordIds, KEYWORDS_EXTENSION
+from utilities.subword import readSubwordBuckets, BUCKETS_EXTENSION
+from utilities.tokenizer import TOKENIZER_VERSION
+from utilities.convertedCorpus import shardPath, writeMeta
+from utilities.manifest import documentHash, conversionKey, readManifest, writeManifest, removeManifest
+from utilities.labelStore import LABEL_STORE_FILE, buildLabelStore, writeLabelStore
+from utilities.augmentation import removeAugmentation
+
+''' Parallel conversion of a ndjson corpus into vector shards. The document range is split into shards of
+    shard_documents documents that are converted by a pool of worker processes. Every worker opens the dictionary once
+    when it starts; the matrix is a read-only memory map, so all workers share the same pages. A shard is written as
+        shard_NNNNN.vectors.bin - float32 matrix with the vectors of all tokens of the shard
+        shard_NNNNN.offsets.bin - int64 start row of every document in the shard (documents + 1 entries)
+    The labels of all documents go into a single columnar store (utilities.labelStore) and meta.json, written last,
+    describes the whole converted corpus. utilities.convertedCorpus reads it back.
+    With token_ids only the dictionary row of every token is stored (shard_NNNNN.tokens.bin, int32) instead of its
+    vectors, and the reader gathers the vectors from the dictionary matrix when a document is requested. A token then
+    takes 4 bytes instead of vector_size floats; unknown words are dropped (skipVec) or stored as -1 (zeroVec). Hashed
+    subword vectors are not rows of the dictionary and can only be converted to vectors.
+    If the dictionary has a keyword channel (utilities.vectorStore), the keyword id of every token is kept as well:
+    a corpus of token ids looks it up from the rows when it is read, a corpus of vectors stores it per token
+    (shard_NNNNN.keywords.bin, int32, -1 for words that are no keyword).
+    A manifest (utilities.manifest) remembers the hash of every document and of the dictionary, so a repeated
+    conversion only writes the shards with new, changed or moved documents and removes the shards beyond the corpus.
+    Documents are looked up by their hash: one that was converted before, in whichever shard, is copied from there and
+    only new or changed documents are converted. The shards are written to a staging directory and moved into place at
+    the end, so the previous shards can be read while their successors are written.
+'''
+
+SHARD_DOCUMENTS = 10000
+
+# version of the output layout, part of the manifest key
+CONVERSION_VERSION = 2
+
+# directory in the output directory the changed shards are written to before they replace the previous ones
+STAGING_DIR = 'incoming'
+
+# number of most frequent unknown words that are reported
+NUM_UNKNOWN_REPORTED = 20
+
+# dictionary of the current worker process, opened once by initConversionWorker
+conversion_worker = dict()
+
+
+def initConversionWorker(dict_file, unknown_vec, token_ids):
+    conversion_worker['vector_store'] = readVectorStore(dict_file)
+    conversion_worker['buckets']      = readSubwordBuckets(dict_file) if unknown_vec == Vec.subwordVec else None
+    conversion_worker['unknown_vec']  = unknown_vec
+    conversion_worker['token_ids']    = token_ids
+    conversion_worker['keyword_ids']  = readKeywordIds(dict_file)
+    conversion_worker['previous']     = dict()
+
+
+# offsets, tokens and keywords (None without a keyword channel) of a shard of the previous conversion, opened once
+# per worker
+def previousShard(output_dir, shard):
+
+    previous = conversion_worker['previous']
+
+    if shard not in previous:
+        token_ids   = conversion_worker['token_ids']
+        tokens_path = shardPath(output_dir, shard, 'tokens' if token_ids else 'vectors')
+        tokens      = np.fromfile(tokens_path, dtype=np.int32 if token_ids else np.float32)
+        if not token_ids:
+            tokens = tokens.reshape(-1, conversion_worker['vector_store'].vector_size)
+        keywords    = None
+        if not token_ids and conversion_worker['keyword_ids'] is not None:
+            keywords = np.fromfile(shardPath(output_dir, shard, 'keywords'), dtype=np.int32)
+        previous[shard] = (np.fromfile(shardPath(output_dir, shard, 'offsets'), dtype=np.int64), tokens, keywords)
+
+    return previous[shard]
+
+
+# convert the documents of one shard and write its files to the staging directory, documents with a location
+# (shard, index) in the previous conversion are copied from there; returns the statistics of the shard
+def convertShard(task):
+
+    shard, documents, locations, output_dir = task
+
+    staging_dir  = os.path.join(output_dir, STAGING_DIR)
+
+    vector_store = conversion_worker['vector_store']
+    unknown_vec  = conversion_worker['unknown_vec']
+    token_ids    = conversion_worker['token_ids']
+    keyword_ids  = conversion_worker['keyword_ids']
+
+    offsets  = np.zeros((len(documents) + 1,), dtype=np.int64)
+    unknown  = Counter()
+    words    = 0
+    keywords = list()
+    copied   = 0
+
+    with open(shardPath(staging_dir, shard, 'tokens' if token_ids else 'vectors'), 'wb') as f:
+        for i, document in enumerate(documents):
+
+            if locations[i] is not None:
+                previous_offsets, previous_tokens, previous_keywords = previousShard(output_dir, locations[i][0])
+                begin, end = previous_offsets[locations[i][1]], previous_offsets[locations[i][1] + 1]
+                previous_tokens[begin:end].tofile(f)
+                if previous_keywords is not None:
+                    keywords.append(previous_keywords[begin:end])
+                offsets[i + 1] = offsets[i] + end - begin
+                copied += 1
+                continue
+
+            text = getTextNdJson(documents, i)
+            rows = vector_store.rows(text)
+
+            if token_ids:
+                tokens = rows[rows >= 0] if unknown_vec == Vec.skipVec else rows
+                tokens.astype(np.int32).tofile(f)
+            else:
+                tokens = documentVectors(vector_store, conversion_worker['buckets'], text, rows, unknown_vec)
+                np.ascontiguousarray(tokens, dtype=np.float32).tofile(f)
+                if keyword_ids is not None:
+                    kept = rows[rows >= 0] if unknown_vec == Vec.skipVec else rows
+                    keywords.append(np.where(kept >= 0, keyword_ids[np.maximum(kept, 0)], -1))
+
+            offsets[i + 1] = offsets[i] + len(tokens)
+
+            unknown.update(text[j] for j in np.flatnonzero(rows < 0))
+            words += len(rows)
+
+    offsets.tofile(shardPath(staging_dir, shard, 'offsets'))
+
+    if not token_ids and keyword_ids is not None:
+        np.concatenate(keywords + [np.zeros((0,), dtype=np.int32)]).astype(np.int32).tofile(
+            shardPath(staging_dir, shard, 'keywords'))
+
+    return {'shard': shard, 'documents': len(documents) - copied, 'copied': copied, 'tokens': int(offsets[-1]),
+            'words': words, 'unknown': unknown}
+
+
+# convert a list of ndjson documents into vector shards (token id shards with token_ids) in output_dir using
+# num_workers processes; with incremental only new or changed documents are converted again. doc_ids
+# are stored with the labels, by default the position of every document in data
+def convertCorpus(data, output_dir, dict_file, unknown_vec=Vec.skipVec, num_workers=None,
+                  shard_documents=SHARD_DOCUMENTS, token_ids=False, incremental=True, doc_ids=None):
+
+    if token_ids and unknown_vec == Vec.subwordVec:
+        raise ValueError("subword vectors of unknown words are not rows of the dictionary, convert them to vectors")
+
+    start = time.time()
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    vector_store = readVectorStore(dict_file)
+    key          = conversionKey(dictionaryFiles(vector_store, unknown_vec),
+                                 'conversion_{}_tokenizer_{}_unknown_{}_tokens_{}_shard_{}'.format(
+                                     CONVERSION_VERSION, TOKENIZER_VERSION, int(unknown_vec), token_ids,
+                                     shard_documents))
+
+    # documents and shard sizes of the previous conversion, if it used the same dictionary and settings
+    hashes       = [documentHash(document) for document in data]
+    manifest     = readManifest(output_dir) if incremental else None
+    previous     = list()
+    shard_tokens = list()
+    if manifest is not None and manifest['key'] == key:
+        previous     = [document[0] for document in manifest['documents']]
+        shard_tokens = manifest['shard_tokens']
+
+    # shard and index in the shard of every document of the previous conversion, by hash
+    locations  = dict()
+    for i, h in enumerate(previous):
+        locations.setdefault(h, (i // shard_documents, i % shard_documents))
+
+    num_shards = (len(data) + shard_documents - 1) // shard_documents
+    changed    = [shard for shard in range(0, num_shards)
+                  if shard >= len(shard_tokens) or hashes[shard * shard_documents:(shard + 1) * shard_documents] !=
+                  previous[shard * shard_documents:(shard + 1) * shard_documents]]
+    stale      = [shard for shard in existingShards(output_dir) if shard >= num_shards]
+
+    shard_tokens = (shard_tokens + [0] * num_shards)[0:num_shards]
+
+    # from here on the output no longer matches the manifest
+    removeManifest(output_dir)
+    removeAugmentation(output_dir)
+
+    staging_dir = os.path.join(output_dir, STAGING_DIR)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    tasks = [(shard, data[shard * shard_documents:(shard + 1) * shard_documents],
+              [locations.get(h) for h in hashes[shard * shard_documents:(shard + 1) * shard_documents]], output_dir)
+             for shard in changed]
+
+    num_workers = min(os.cpu_count() if num_workers is None else num_workers, max(1, len(tasks)))
+
+    # a single worker converts in this process, there is nothing to gain from a pool
+    if num_workers == 1:
+        initConversionWorker(dict_file, unknown_vec, token_ids)
+        results = [convertShard(task) for task in tasks]
+    else:
+        with mp.Pool(num_workers, initializer=initConversionWorker,
+                     initargs=(dict_file, unknown_vec, token_ids)) as pool:
+            results = list(pool.imap(convertShard, tasks))
+
+    # the previous shards are no longer read, replace them by the staged ones
+    removeShards(output_dir, changed + stale)
+    for name in os.listdir(staging_dir):
+        os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+    os.rmdir(staging_dir)
+
+    for result in results:
+        shard_tokens[result['shard']] = result['tokens']
+
+    # labels are fields of the documents, collecting them is cheap enough to do for the whole corpus every time
+    writeLabelStore(os.path.join(output_dir, LABEL_STORE_FILE), buildLabelStore(data, doc_ids))
+
+    # a plain conversion is never augmented, utilities.augmentation.writeAugmentation turns it on afterwards
+    writeMeta(output_dir, {'vector_size':     vector_store.vector_size,
+                           'token_ids':       token_ids,
+                           'dict_file':       dict_file,
+                           'num_vectors':     vector_store.num_vectors,
+                           'keyword_channel': readKeywordIds(dict_file) is not None,
+                           'augmented':       False,
+                           'num_documents':   len(data),
+                           'shard_documents': shard_documents,
+                           'shard_tokens':    shard_tokens})
+
+    output = 'tokens' if token_ids else 'vectors'
+    writeManifest(output_dir, {'key':          key,
+                               'documents':    [[h, os.path.basename(shardPath(output_dir, i // shard_documents, output))]
+                                                for i, h in enumerate(hashes)],
+                               'shard_tokens': shard_tokens})
+
+    num_misses = sum(1 for h in hashes if h not in locations)
+    num_copied = sum(result['copied'] for result in results)
+
+    reportConversion(results, time.time() - start, num_workers)
+    print("Manifest: {} documents unchanged, {} moved and copied, {} new or changed, {} of {} shards written, {} stale "
+          "shards removed".format(len(data) - num_misses - num_copied, num_copied, num_misses, len(changed), num_shards,
+                                  len(stale)))
+
+    return results
+
+
+# files whose content determines the output: the binary dictionary, its keyword channel and, for subword vectors,
+# the bucket matrix
+def dictionaryFiles(vector_store, unknown_vec):
+
+    paths = [vector_store.matrix_path, vector_store.index_path]
+    if os.path.exists(vector_store.dict_file_path + KEYWORDS_EXTENSION):
+        paths += [vector_store.dict_file_path + KEYWORDS_EXTENSION]
+    if unknown_vec == Vec.subwordVec:
+        paths += [vector_store.dict_file_path + BUCKETS_EXTENSION + extension for extension in ('.bin', '.idx')]
+
+    return paths
+
+
+# numbers of the shards that have files in output_dir
+def existingShards(output_dir):
+    names = [name for name in os.listdir(output_dir) if name.startswith('shard_')]
+    return sorted(set(int(name[len('shard_'):].split('.')[0]) for name in names))
+
+
+# delete every file of the given shards, vectors and tokens alike
+def removeShards(output_dir, shards):
+
+    shards = set(shards)
+
+    for name in os.listdir(output_dir):
+        if name.startswith('shard_') and int(name[len('shard_'):].split('.')[0]) in shards:
+            os.remove(os.path.join(output_dir, name))
+
+
+# documents per second and unknown words aggregated over all shards
+def reportConversion(results, elapsed, num_workers):
+
+    num_documents = sum(result['documents'] for result in results)
+    total_words   = sum(result['words'] for result in results)
+    unknown       = Counter()
+    for result in results:
+        unknown.update(result['unknown'])
+
+    num_unknown_words     = sum(unknown.values())
+    percent_unknown_words = num_unknown_words * 100 / max(total_words, 1)
+
+    sys.stderr.flush()
+    print("\nConverted {} documents in {} shards with {} workers: {:.1f} seconds, {:.0f} documents per second".format(
+        num_documents, len(results), num_workers, elapsed, num_documents / max(elapsed, 1e-9)))
+    print("Total number of words {}, unknown words {}, percentage unknown words {}".format(total_words,
+                                                                                          num_unknown_words,
+                                                                                          percent_unknown_words))
+    print("Distinct unknown words {}, most frequent: {}".format(len(unknown), unknown.most_common(NUM_UNKNOWN_REPORTED)))
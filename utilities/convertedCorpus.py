@@ -0,0 +1,131 @@
+import os
+import json
+import numpy as np
+from utilities.vectorStore import readVectorStore, readKeywordIds
+from utilities.labelStore import LABEL_STORE_FILE, readLabelStore
+
+''' Reader of a corpus converted by utilities.conversion. The vectors of every shard are memory-mapped, a document is
+    a slice of the matrix of its shard; offsets and the label store are small and read completely.
+    A corpus converted with token_ids holds dictionary rows instead of vectors. The dictionary it was converted with
+    (or dict_file, e.g. after moving it) is opened as a vector store, and the vectors of a document are gathered from
+    its matrix only when the document is requested; rows of -1 (unknown words) give zero vectors.
+    If the dictionary has a keyword channel, keywordIds gives the keyword id of every token of a document next to its
+    vectors (-1 for words that are no keyword).
+'''
+
+
+# file of a shard in the output directory of a conversion
+def shardPath(output_dir, shard, name, extension='.bin'):
+    return os.path.join(output_dir, 'shard_{0:05d}.{1}{2}'.format(shard, name, extension))
+
+
+# description of a converted corpus written by utilities.conversion
+def readMeta(output_dir):
+    with open(os.path.join(output_dir, 'meta.json')) as f:
+        return json.load(f)
+
+
+def writeMeta(output_dir, meta):
+
+    path = os.path.join(output_dir, 'meta.json')
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+
+    os.replace(path + '.tmp', path)
+
+
+class ConvertedCorpus:
+
+    def __init__(self, output_dir, dict_file=None):
+
+        meta = readMeta(output_dir)
+
+        self.vector_size     = meta['vector_size']
+        self.num_documents   = meta['num_documents']
+        self.shard_documents = meta['shard_documents']
+        self.token_ids       = meta.get('token_ids', False)
+        self.keyword_channel = meta.get('keyword_channel', False)
+        self.vector_store    = None
+        self.keyword_ids     = None
+
+        if self.token_ids:
+            dict_file         = meta['dict_file'] if dict_file is None else dict_file
+            self.vector_store = readVectorStore(dict_file)
+            if self.vector_store.num_vectors != meta['num_vectors']:
+                raise ValueError("{} was converted with a dictionary of {} words, {} has {}".format(
+                    output_dir, meta['num_vectors'], self.vector_store.dict_file_path, self.vector_store.num_vectors))
+            if self.keyword_channel:
+                self.keyword_ids = readKeywordIds(dict_file)
+                if self.keyword_ids is None:
+                    raise ValueError("{} was converted with a keyword channel, {} has none".format(output_dir,
+                                                                                                 dict_file))
+
+        self.label_store    = readLabelStore(os.path.join(output_dir, LABEL_STORE_FILE))
+        self.shard_tokens   = list()
+        self.shard_offsets  = list()
+        self.shard_keywords = list()
+
+        for shard, num_tokens in enumerate(meta['shard_tokens']):
+            self.shard_offsets.append(np.fromfile(shardPath(output_dir, shard, 'offsets'), dtype=np.int64))
+            self.shard_tokens.append(self.openTokens(output_dir, shard, num_tokens))
+            if self.keyword_channel and not self.token_ids:
+                self.shard_keywords.append(np.fromfile(shardPath(output_dir, shard, 'keywords'), dtype=np.int32))
+
+
+    def __len__(self):
+        return self.num_documents
+
+
+    # memory map of the vectors (or dictionary rows) of a shard
+    def openTokens(self, output_dir, shard, num_tokens):
+
+        if self.token_ids:
+            if num_tokens == 0:
+                return np.zeros((0,), dtype=np.int32)
+            return np.memmap(shardPath(output_dir, shard, 'tokens'), dtype=np.int32, mode='r', shape=(num_tokens,))
+
+        if num_tokens == 0:
+            return np.zeros((0, self.vector_size), dtype=np.float32)
+        return np.memmap(shardPath(output_dir, shard, 'vectors'), dtype=np.float32, mode='r',
+                         shape=(num_tokens, self.vector_size))
+
+
+    # vectors (or dictionary rows) of a single document as stored
+    def tokens(self, index):
+        shard, index = divmod(index, self.shard_documents)
+        offsets = self.shard_offsets[shard]
+        return self.shard_tokens[shard][offsets[index]:offsets[index+1]]
+
+
+    # dictionary rows of a single document of a corpus of token ids
+    def documentRows(self, index):
+        return self.tokens(index)
+
+
+    # vectors of a single document
+    def document(self, index):
+
+        if not self.token_ids:
+            return self.tokens(index)
+
+        return self.gather(self.documentRows(index))
+
+
+    # keyword id of every token of a single document
+    def keywordIds(self, index):
+
+        if not self.token_ids:
+            shard, index = divmod(index, self.shard_documents)
+            offsets = self.shard_offsets[shard]
+            return self.shard_keywords[shard][offsets[index]:offsets[index+1]]
+
+        rows = self.documentRows(index)
+        return np.where(rows >= 0, self.keyword_ids[np.maximum(rows, 0)], -1)
+
+
+    # vectors of dictionary rows, zero vectors for -1
+    def gather(self, rows):
+        vectors = self.vector_store.matrix[np.maximum(rows, 0)]
+        vectors[rows < 0] = 0.0
+        return vectors
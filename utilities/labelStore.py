@@ -0,0 +1,79 @@
+import os
+import numpy as np
+
+''' Columnar store of the labels of a converted corpus, replacing one small label file per document. The labels of all
+    documents are kept in a single file (labels.npz) holding
+        doc_ids - int64 id of every document (its index in the ndjson corpus it was taken from)
+        columns - int32 matrix with one column per label field, the id of the label string (-1 if the field is missing)
+        fields  - names of the label fields, in the order of utilities.labelType
+        strings - dictionary of all label strings
+    and is read completely in one go.
+'''
+
+LABEL_STORE_FILE = 'labels.npz'
+
+# fields of utilities.labelType (not imported, utilities.utilities depends on the readers of this module)
+LABEL_FIELDS = ['property_type', 'tenement_steading', 'exclusive_strata', 'exclusive_solum', 'common_strata',
+                'common_solum', 'additional_info', 'char_count']
+
+
+class LabelStore:
+
+    def __init__(self, doc_ids, columns, fields, strings):
+
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.columns = np.asarray(columns, dtype=np.int32).reshape(len(self.doc_ids), len(fields))
+        self.fields  = list(fields)
+        self.strings = list(strings)
+
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+    # label string ids of a field for all documents
+    def column(self, field):
+        return self.columns[:, self.fields.index(field)]
+
+
+    # label strings of a field for all documents, None where the field is missing
+    def values(self, field):
+        return [self.strings[i] if i >= 0 else None for i in self.column(field)]
+
+
+    # labels of num_copies consecutive copies of the corpus
+    def tile(self, num_copies):
+        return LabelStore(np.tile(self.doc_ids, num_copies), np.tile(self.columns, (num_copies, 1)), self.fields,
+                          self.strings)
+
+
+# collect the labels of ndjson documents, doc_ids defaults to the position of every document
+def buildLabelStore(documents, doc_ids=None, fields=LABEL_FIELDS):
+
+    string_ids = dict()
+    columns    = np.full((len(documents), len(fields)), -1, dtype=np.int32)
+
+    for i, document in enumerate(documents):
+        for j, field in enumerate(fields):
+            if field in document:
+                columns[i, j] = string_ids.setdefault(str(document[field]), len(string_ids))
+
+    doc_ids = np.arange(len(documents)) if doc_ids is None else doc_ids
+
+    return LabelStore(doc_ids, columns, fields, list(string_ids))
+
+
+# write a label store through a temporary file like the other binary stores
+def writeLabelStore(path, store):
+
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, doc_ids=store.doc_ids, columns=store.columns, fields=np.array(store.fields, dtype=str),
+                 strings=np.array(store.strings, dtype=str))
+
+    os.replace(path + '.tmp', path)
+
+
+def readLabelStore(path):
+
+    with np.load(path) as f:
+        return LabelStore(f['doc_ids'], f['columns'], f['fields'].tolist(), f['strings'].tolist())
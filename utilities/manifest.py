@@ -0,0 +1,64 @@
+import os
+import json
+import hashlib
+
+''' Manifest of a converted corpus, kept next to meta.json in the output directory. It records the conversion key (a
+    hash of the dictionary files and of every setting that changes the output) and, for every document in the order of
+    the corpus, the hash of the document and the file its output was written to. A later conversion looks documents up
+    by their hash rather than by their position: shards whose documents are all unchanged and in place are kept, the
+    other shards are written again, copying every document that was converted before (wherever it was) and converting
+    only new or changed ones. Inserting a document near the front thus rewrites the following shards but converts a
+    single document. When the key differs every document counts as changed. The manifest is removed before any output
+    is rewritten and written again at the very end, so an interrupted conversion is never mistaken for a finished one.
+'''
+
+MANIFEST_FILE = 'manifest.json'
+HASH_CHUNK    = 1 << 20
+
+
+# hash of a ndjson document, text and labels alike
+def documentHash(document):
+    return hashlib.sha1(json.dumps(document, sort_keys=True, ensure_ascii=False).encode('utf8')).hexdigest()
+
+
+# hash of the content of some files combined with a settings string
+def conversionKey(paths, settings):
+
+    digest = hashlib.sha1()
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+
+    digest.update(settings.encode('utf8'))
+
+    return digest.hexdigest()
+
+
+# manifest of a previous conversion, None if there is none
+def readManifest(output_dir):
+
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf8") as f:
+        return json.load(f)
+
+
+def writeManifest(output_dir, manifest):
+
+    path = os.path.join(output_dir, MANIFEST_FILE)
+
+    with open(path + '.tmp', 'w', encoding="utf8") as f:
+        json.dump(manifest, f)
+
+    os.replace(path + '.tmp', path)
+
+
+def removeManifest(output_dir):
+
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        os.remove(path)
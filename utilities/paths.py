@@ -80,6 +80,7 @@ class RosDataPaths():
 
         # word2vec model weights
         self.w2v_model_param = './data/w2v/training/models/'
+        self.w2v_checkpoint  = './data/w2v/training/models/checkpoint.pt'
         
         # word2vec training results
         self.w2v_csv_lss_dir   = './data/w2v/performance/csv_losses/'
@@ -102,6 +103,10 @@ class RosDataPaths():
         
         self.vec_files_train_labels = generateFilePaths('./data/lstm/training/vectors/trainsetlabels/labels_', num_train, '.txt')
         self.vec_files_test_labels  = generateFilePaths('./data/lstm/training/vectors/testsetlabels/labels_', num_test, '.txt')
+
+        # lstm training data converted into vector shards (utilities.conversion)
+        self.converted_train = './data/lstm/training/vectors/converted_train/'
+        self.converted_test  = './data/lstm/training/vectors/converted_test/'
       
         
         # lstm training results
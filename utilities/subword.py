@@ -0,0 +1,105 @@
+import os
+import numpy as np
+
+''' Hashed character n-grams as used by fastText. Every word is wrapped in '<' and '>' and all of its character
+    n-grams with MIN_N <= n <= MAX_N are hashed with 32 bit FNV-1a into a fixed number of buckets, so the size of the
+    input embedding no longer depends on the vocabulary. The vector of a word is the mean of its bucket vectors, which
+    also gives vectors for words that were never seen during training (new street names, surnames, OCR variants).
+    The bucket matrix is stored next to the dictionary in the layout of the vector store: a raw float32 matrix
+    (<dict>.buckets.bin) and a one line index (<dict>.buckets.idx) holding num_buckets vector_size min_n max_n.
+'''
+
+MIN_N = 3
+MAX_N = 6
+
+BUCKETS_EXTENSION = '.buckets'
+MATRIX_EXTENSION  = '.bin'
+INDEX_EXTENSION   = '.idx'
+
+FNV_OFFSET = 2166136261
+FNV_PRIME  = 16777619
+
+
+# 32 bit FNV-1a; bytes are sign extended first, like the int8_t cast of fastText, so bucket ids match its models
+def fnv1a(data):
+    h = FNV_OFFSET
+    for byte in data:
+        h = ((h ^ (byte | 0xFFFFFF00 if byte > 127 else byte)) * FNV_PRIME) & 0xFFFFFFFF
+    return h
+
+
+# character n-grams of a word including the begin and end of word markers
+def wordNgrams(word, min_n=MIN_N, max_n=MAX_N):
+    word = '<' + word + '>'
+    return [word[i:i + n] for n in range(min_n, max_n + 1) for i in range(0, len(word) - n + 1)]
+
+
+# bucket ids of the n-grams of a word
+def subwordIds(word, num_buckets, min_n=MIN_N, max_n=MAX_N):
+    return np.array([fnv1a(ngram.encode('utf8')) % num_buckets for ngram in wordNgrams(word, min_n, max_n)],
+                    dtype=np.int64)
+
+
+# bucket ids of a whole vocabulary as one flat array, with the start and number of ids of every word
+def subwordTable(words, num_buckets, min_n=MIN_N, max_n=MAX_N):
+
+    ids     = [subwordIds(word, num_buckets, min_n, max_n) for word in words]
+    lengths = np.array([len(word_ids) for word_ids in ids], dtype=np.int64)
+    starts  = np.zeros((len(words),), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    flat = np.concatenate(ids) if len(ids) > 0 else np.zeros((0,), dtype=np.int64)
+
+    return flat, starts, lengths
+
+
+class SubwordBuckets:
+
+    def __init__(self, dict_file_path):
+
+        path = dict_file_path + BUCKETS_EXTENSION
+
+        with open(path + INDEX_EXTENSION, encoding="utf8") as f:
+            header = f.readline().split()
+
+        self.num_buckets = int(header[0])
+        self.vector_size = int(header[1])
+        self.min_n       = int(header[2])
+        self.max_n       = int(header[3])
+
+        self.matrix = np.memmap(path + MATRIX_EXTENSION, dtype=np.float32, mode='r',
+                                shape=(self.num_buckets, self.vector_size))
+
+
+    # mean bucket vector of every word, zero padded to size columns (e.g. the keyword part of the dictionary); words
+    # without any n-gram get a zero vector, like an empty bag of the model
+    def vectors(self, words, size=None):
+
+        vectors = np.zeros((len(words), self.vector_size if size is None else size), dtype=np.float32)
+        for row, word in enumerate(words):
+            ids = subwordIds(word, self.num_buckets, self.min_n, self.max_n)
+            if len(ids) > 0:
+                vectors[row, 0:self.vector_size] = self.matrix[ids].mean(axis=0)
+
+        return vectors
+
+
+# open the bucket matrix stored next to a dictionary
+def readSubwordBuckets(dict_file_path):
+    return SubwordBuckets(dict_file_path)
+
+
+# write the bucket matrix next to a dictionary, through temporary files like the vector store
+def writeSubwordBuckets(dict_file_path, matrix, min_n, max_n):
+
+    path   = dict_file_path + BUCKETS_EXTENSION
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    with open(path + MATRIX_EXTENSION + '.tmp', 'wb') as f:
+        matrix.tofile(f)
+
+    with open(path + INDEX_EXTENSION + '.tmp', 'w', encoding="utf8") as f:
+        f.write('%d %d %d %d\n' % (matrix.shape[0], matrix.shape[1], min_n, max_n))
+
+    os.replace(path + MATRIX_EXTENSION + '.tmp', path + MATRIX_EXTENSION)
+    os.replace(path + INDEX_EXTENSION + '.tmp', path + INDEX_EXTENSION)
@@ -0,0 +1,88 @@
+import re
+import numpy as np
+from string import punctuation
+
+''' Tokenizer shared by the word2vec readers and the document conversion. The output is identical to the original
+    character by character parseLine: lower case, remove everything in parentheses, remove punctuation and remove
+    non-ascii characters. After lower casing the line is encoded to ascii, which drops the non-ascii characters in
+    one step, and the remaining work is done on bytes with a precompiled pattern and a translate deletion table.
+    Dropping non-ascii characters before the parentheses are removed gives the same result, because neither
+    parentheses nor newlines are affected by the encoding.
+'''
+
+PARENTHESES       = re.compile(rb'\(.*?\)')
+PUNCTUATION_BYTES = punctuation.encode('ascii')
+
+# documents are joined with this separator for batch processing; '.' in PARENTHESES never matches the newlines
+BATCH_SEPARATOR   = '\n\x00\n'
+
+# bump whenever the output of the tokenizer changes, cached token streams depend on it
+TOKENIZER_VERSION = 1
+
+
+# cleans a line of text from punctuation and other special characters before processing
+def parseLine(line):
+    line = line.lower().encode('ascii', 'ignore')
+    if b'(' in line:
+        line = PARENTHESES.sub(b'', line)
+    return line.translate(None, PUNCTUATION_BYTES).decode('ascii')
+
+
+# parse many lines at once, the result is the same as calling parseLine on every line
+def parseLines(lines):
+
+    if len(lines) == 0:
+        return list()
+
+    # fall back to line by line parsing if the separator could clash with the text
+    if any('\x00' in line for line in lines):
+        return [parseLine(line) for line in lines]
+
+    return parseLine(BATCH_SEPARATOR.join(lines)).split(BATCH_SEPARATOR)
+
+
+# split a line of a text document into words
+def tokenizeLine(line):
+    return parseLine(line).split()
+
+
+# split a ndjson document into words, the address of the property is replaced by the keyword 'address'
+def tokenizeDocument(document):
+    address = parseLine(document['address'][0]['prettyPrint'])
+    text    = parseLine(document['text'])
+    return splitDocument(text, address)
+
+
+def splitDocument(text, address):
+    return [item for item in text.replace(address, 'address').split(' ') if len(item) > 0]
+
+
+# batch version of tokenizeLine
+def tokenizeLines(lines):
+    return [line.split() for line in parseLines(lines)]
+
+
+# batch version of tokenizeDocument
+def tokenizeDocuments(documents):
+    texts     = parseLines([document['text'] for document in documents])
+    addresses = parseLines([document['address'][0]['prettyPrint'] for document in documents])
+    return [splitDocument(text, address) for text, address in zip(texts, addresses)]
+
+
+# map token lists to one flat int32 array of word ids and the offsets of every document within that array
+def encodeTokens(token_lists, word2id, drop_unknown=True):
+
+    lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+    ids     = np.fromiter((word2id.get(word, -1) for tokens in token_lists for word in tokens),
+                          dtype=np.int32, count=int(lengths.sum()))
+
+    if drop_unknown:
+        known   = ids >= 0
+        docs    = np.repeat(np.arange(len(token_lists)), lengths)
+        lengths = np.bincount(docs[known], minlength=len(token_lists))
+        ids     = ids[known]
+
+    offsets = np.zeros((len(token_lists) + 1,), dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return ids, offsets
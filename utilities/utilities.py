@@ -1,14 +1,15 @@
 import torch
-import re
 import sys
 import csv
 import time
 import datetime
 import numpy as np
 import os
-from string import punctuation
 from lstm.file2VecConverter import File2VecConverter
 from lstm.dataReaderVec import VectorDataset
+from utilities.vectorStore import readVectorStore, writeVectors
+from utilities.subword import readSubwordBuckets
+from utilities.tokenizer import parseLine, tokenizeDocument
 
 from enum import IntEnum
                     
@@ -30,6 +31,7 @@ class Mode(IntEnum):
     similarity = 3
     plot       = 4
     display    = 5
+    benchmark  = 6
 
 
 class weightInit(IntEnum):
@@ -39,17 +41,19 @@ class weightInit(IntEnum):
 
 
 class Vec(IntEnum):
-    zeroVec = 0
-    skipVec = 1
+    zeroVec    = 0
+    skipVec    = 1
+    subwordVec = 2
 
 
-# cleans a line of text from punctuation and other special characters before processing
-def parseLine(line):
-    line = line.lower()
-    line = re.sub(r'\(.*?\)', '', line) #remove special characters
-    line = ''.join([c for c in line if c not in punctuation])
-    line = re.sub(r'[^\x00-\x7f]', r'', line) #remove hex characters
-    return line
+class Objective(IntEnum):
+    negativeSampling    = 0
+    hierarchicalSoftmax = 1
+
+
+class Architecture(IntEnum):
+    skipGram = 0
+    cbow     = 1
 
 
 # returns a list of file paths from the same directory to avoid manual initialisation
@@ -61,17 +65,7 @@ def generateFilePaths(path, number_of_docs, extension):
     
 
 def getTextNdJson(data, index):
-
-    address    = parseLine(data[index]['address'][0]['prettyPrint']) 
-    text_array = parseLine(data[index]['text']).replace(address, 'address').split(' ') 
-
-    result = list()
-    
-    for item in text_array:
-        if len(item) > 0:
-            result.append(item)
-            
-    return result  
+    return tokenizeDocument(data[index])
 
 
 def ndjsonVectorisation(data, vec_files, labels, dict_file, unknown_vec):
@@ -79,23 +73,20 @@ def ndjsonVectorisation(data, vec_files, labels, dict_file, unknown_vec):
     num_unknown_words = 0
     total_num_words   = 0
 
-    vector_dict, params = readVectorsDict(dict_file)
+    vector_store = readVectorStore(dict_file)
+    buckets      = readSubwordBuckets(dict_file) if unknown_vec == Vec.subwordVec else None
 
     for i in range(0, len(vec_files)):
         
         text = getTextNdJson(data, i)
-            
-        with open(vec_files[i], 'w') as f:
+        rows = vector_store.rows(text)
         
-            # replace words with vectors
-            for word in text:
+        # replace words with vectors
+        with open(vec_files[i], 'w') as f:
+            writeVectors(f, documentVectors(vector_store, buckets, text, rows, unknown_vec))
             
-                if word in vector_dict:
-                    f.write(str(vector_dict[word]).replace("'", "").replace(", ", " ").replace("[", "").replace("]", "")+'\n')
-                else:
-                    num_unknown_words += 1
-                    
-                total_num_words += 1
+        num_unknown_words += int(np.count_nonzero(rows < 0))
+        total_num_words   += len(rows)
                 
         with open(labels[i], 'w') as f:
             f.write(data[i]['property_type'] + '\n')
@@ -111,6 +102,23 @@ def ndjsonVectorisation(data, vec_files, labels, dict_file, unknown_vec):
                                                                                               percent_unknown_words))            
 
 
+# vectors of a tokenized document; unknown words are skipped, replaced by zeros or, with subword buckets, by the mean
+# of their n-gram vectors followed by the zero keyword part
+def documentVectors(vector_store, buckets, words, rows, unknown_vec):
+
+    if unknown_vec == Vec.skipVec:
+        return vector_store.matrix[rows[rows >= 0]]
+
+    vectors = vector_store.matrix[np.maximum(rows, 0)]
+    unknown = np.flatnonzero(rows < 0)
+    vectors[unknown] = 0.0
+
+    if unknown_vec == Vec.subwordVec and len(unknown) > 0:
+        vectors[unknown] = buckets.vectors([words[i] for i in unknown], vector_store.vector_size)
+
+    return vectors
+
+
 # convert documents into vector representations and write them to files
 def documentVectorisation(doc_files, vec_files, dict_file, unknown_vec, debug=False):
 
@@ -149,12 +157,16 @@ def getMaxDocumentLength(dict_file):
 
 
 # saves accuracy measures obtained during training to csv file
-def writeDataToCSV(data, filename):
+# an optional note (e.g. why training stopped) goes into a third column of the last row, readers only use the first two
+def writeDataToCSV(data, filename, note=None):
     x_axis = np.arange(len(data))
     with open(filename, mode='w', newline='') as csv_file:
         accuracy_writer = csv.writer(csv_file, delimiter=',')
         for i in range(0, len(data)):
-            accuracy_writer.writerow([x_axis[i],data[i]])
+            if note is not None and i == len(data) - 1:
+                accuracy_writer.writerow([x_axis[i],data[i],note])
+            else:
+                accuracy_writer.writerow([x_axis[i],data[i]])
 
 
 # reads accuracy value from csv; needed for plotting a graph with matplotlib
@@ -183,13 +195,13 @@ def getFilesInDirectory(directory):
 
 
 # write lstm or word2vec accuracies and losses to csv
-def resultsToCSV(parcel, lstm_info, csv_losses_dir, csv_accuracies_dir=None):
+def resultsToCSV(parcel, lstm_info, csv_losses_dir, csv_accuracies_dir=None, note=None):
 
     timestamp = timeStampedFileName()
 
     losses = parcel[0] if csv_accuracies_dir else parcel
     lss_csv_file = csv_losses_dir + 'lss_' + lstm_info + '_date_' + timestamp + '.csv'
-    writeDataToCSV(losses, lss_csv_file)
+    writeDataToCSV(losses, lss_csv_file, note)
 
     if csv_accuracies_dir:
 
@@ -0,0 +1,176 @@
+import os
+import numpy as np
+
+''' Binary counterpart of the text dictionary (dict.vec). The vectors are kept as one contiguous float32 matrix
+    (<dict>.bin) that is opened through np.memmap, while the words and the header metadata live in a small index
+    file (<dict>.idx). The first line of the index mirrors the text header: num_vectors vector_size max_num_words_file,
+    followed by one word per line in row order. The binary files are derived from the text dictionary the first time
+    it is loaded and rebuilt whenever the text dictionary is newer.
+    A dictionary exported with a keyword channel holds only the dense part of every vector; the keyword id of every
+    row (-1 for words that are no keyword) is stored next to it (<dict>.keywords.bin, int32).
+'''
+
+MATRIX_EXTENSION   = '.bin'
+INDEX_EXTENSION    = '.idx'
+KEYWORDS_EXTENSION = '.keywords.bin'
+
+# enough significant digits to restore every float32 exactly
+FLOAT_FORMAT      = '%.9g'
+FORMAT_CHUNK_SIZE = 10000
+
+
+class VectorStore:
+
+    def __init__(self, dict_file_path):
+
+        self.dict_file_path = dict_file_path
+        self.matrix_path    = dict_file_path + MATRIX_EXTENSION
+        self.index_path     = dict_file_path + INDEX_EXTENSION
+
+        if self.isStale():
+            convertTextDict(dict_file_path)
+
+        self.words, params = readIndex(self.index_path)
+
+        self.num_vectors        = params[0]
+        self.vector_size        = params[1]
+        self.max_num_words_file = params[2]
+
+        self.word2row = {word: row for row, word in enumerate(self.words)}
+        self.matrix   = np.memmap(self.matrix_path, dtype=np.float32, mode='r',
+                                  shape=(self.num_vectors, self.vector_size))
+
+
+    def __len__(self):
+        return self.num_vectors
+
+
+    def __contains__(self, word):
+        return word in self.word2row
+
+
+    def __getitem__(self, word):
+        return self.matrix[self.word2row[word]]
+
+
+    # same header tuple as utilities.readVectorsDict
+    def params(self):
+        return (self.num_vectors, self.vector_size, self.max_num_words_file)
+
+
+    # row index of every word, -1 for words that are not in the dictionary
+    def rows(self, words):
+        return np.fromiter((self.word2row.get(word, -1) for word in words), dtype=np.int64, count=len(words))
+
+
+    # binary files are missing or older than the text dictionary they were derived from
+    def isStale(self):
+        if not os.path.exists(self.dict_file_path):
+            return False
+        if not os.path.exists(self.matrix_path) or not os.path.exists(self.index_path):
+            return True
+        return os.path.getmtime(self.dict_file_path) > min(os.path.getmtime(self.matrix_path),
+                                                            os.path.getmtime(self.index_path))
+
+
+# open the binary dictionary belonging to a text dictionary, converting it first if necessary
+def readVectorStore(dict_file_path):
+    return VectorStore(dict_file_path)
+
+
+# read words and header metadata of a binary dictionary
+def readIndex(index_path):
+
+    with open(index_path, encoding="utf8") as f:
+        header = f.readline().split()
+        words  = [line.rstrip('\n') for line in f]
+
+    return words, (int(header[0]), int(header[1]), int(header[2]))
+
+
+# write matrix and index of a binary dictionary
+def writeVectorStore(dict_file_path, words, matrix, max_num_words_file):
+
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    # write to temporary files first so that readers never see half written dictionaries
+    with open(dict_file_path + MATRIX_EXTENSION + '.tmp', 'wb') as f:
+        matrix.tofile(f)
+
+    with open(dict_file_path + INDEX_EXTENSION + '.tmp', 'w', encoding="utf8") as f:
+        f.write('%d %d %d\n' % (matrix.shape[0], matrix.shape[1], max_num_words_file))
+        for word in words:
+            f.write(word + '\n')
+
+    os.replace(dict_file_path + MATRIX_EXTENSION + '.tmp', dict_file_path + MATRIX_EXTENSION)
+    os.replace(dict_file_path + INDEX_EXTENSION + '.tmp', dict_file_path + INDEX_EXTENSION)
+
+
+# write the keyword channel of a dictionary
+def writeKeywordIds(dict_file_path, keyword_ids):
+
+    with open(dict_file_path + KEYWORDS_EXTENSION + '.tmp', 'wb') as f:
+        np.ascontiguousarray(keyword_ids, dtype=np.int32).tofile(f)
+
+    os.replace(dict_file_path + KEYWORDS_EXTENSION + '.tmp', dict_file_path + KEYWORDS_EXTENSION)
+
+
+# keyword id of every row of a dictionary, None if it was exported without a keyword channel
+def readKeywordIds(dict_file_path):
+
+    if not os.path.exists(dict_file_path + KEYWORDS_EXTENSION):
+        return None
+
+    return np.fromfile(dict_file_path + KEYWORDS_EXTENSION, dtype=np.int32)
+
+
+# remove the keyword channel of an earlier export, the dictionary now holds the keywords itself
+def removeKeywordIds(dict_file_path):
+    if os.path.exists(dict_file_path + KEYWORDS_EXTENSION):
+        os.remove(dict_file_path + KEYWORDS_EXTENSION)
+
+
+# parse the text dictionary once and write its binary equivalent
+def convertTextDict(dict_file_path):
+
+    with open(dict_file_path, encoding="utf8") as f:
+
+        header      = f.readline().split()
+        num_vectors = int(header[0])
+        vector_size = int(header[1])
+        max_words   = int(header[2])
+
+        words  = list()
+        matrix = np.zeros((num_vectors, vector_size), dtype=np.float32)
+
+        for i in range(0, num_vectors):
+            vector = f.readline().split()
+            words.append(vector[0])
+            matrix[i] = vector[1:]
+
+    writeVectorStore(dict_file_path, words, matrix, max_words)
+
+
+# write a matrix in the text dictionary format (word followed by its vector on every line)
+def writeVectorsText(dict_file_path, words, matrix, max_num_words_file):
+
+    with open(dict_file_path, 'w', encoding="utf8") as f:
+        f.write('%d %d %d\n' % (matrix.shape[0], matrix.shape[1], max_num_words_file))
+        for start in range(0, len(words), FORMAT_CHUNK_SIZE):
+            end   = start + FORMAT_CHUNK_SIZE
+            lines = formatVectors(matrix[start:end]).splitlines()
+            f.write(''.join(['%s %s\n' % (word, line) for word, line in zip(words[start:end], lines)]))
+
+
+# format vectors as space separated text, one vector per line; the whole block is formatted by a single % operation
+def formatVectors(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+    if vectors.size == 0:
+        return ''
+    line = ' '.join([FLOAT_FORMAT] * vectors.shape[1]) + '\n'
+    return (line * vectors.shape[0]) % tuple(vectors.ravel().tolist())
+
+
+# write vectors of a converted document to an open file
+def writeVectors(f, vectors):
+    f.write(formatVectors(vectors))
@@ -0,0 +1,64 @@
+import os
+import random
+import threading
+import numpy as np
+import torch
+
+''' Training checkpoints. A checkpoint bundles everything needed to continue a run exactly where it stopped: model,
+    optimizer and scheduler state, the state of every random number generator, the next epoch and the loss history.
+    The state is copied to the CPU in the training thread, so training can continue while a background thread writes
+    the copy. Files are written under a temporary name and moved into place with os.replace, a run that dies while
+    writing always leaves the previous checkpoint intact.
+'''
+
+
+# detached CPU copy of nested state dicts, later training steps do not change the copy
+def cloneState(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: cloneState(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(cloneState(value) for value in state)
+    return state
+
+
+# state of the random number generators of torch, numpy and python
+def rngState():
+    return {'torch':  torch.get_rng_state(),
+            'cuda':   torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy':  np.random.get_state(),
+            'python': random.getstate()}
+
+
+def setRngState(state):
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+
+
+# write a checkpoint atomically
+def writeCheckpoint(path, state):
+    torch.save(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# copy the state and write it, in a background thread if requested; the thread is returned so it can be joined
+def saveCheckpoint(path, state, background=False):
+
+    state = cloneState(state)
+
+    if not background:
+        writeCheckpoint(path, state)
+        return None
+
+    thread = threading.Thread(target=writeCheckpoint, args=(path, state))
+    thread.start()
+    return thread
+
+
+def readCheckpoint(path, device='cpu'):
+    # the checkpoint holds numpy and python RNG states next to the tensors
+    return torch.load(path, map_location=device, weights_only=False)
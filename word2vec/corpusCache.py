@@ -0,0 +1,256 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from utilities import tokenizer
+from word2vec.vocabulary import VocabularyCounter
+
+''' Pre-tokenized version of a ndjson corpus. The first time a corpus is read every document is tokenized (including
+    the address replacement) and the result is written next to the corpus as
+        words.json              - vocabulary in id order and the frequency of every word
+        shard_NNNNN.tokens.bin  - flat int32 array with the word ids of the documents of a shard
+        shard_NNNNN.offsets.bin - int64 start offset of every document in its shard (documents + 1 entries)
+        meta.json               - number of documents and tokens, longest document, tokens per shard
+    Every shard holds shard_documents consecutive documents (the last one possibly fewer), so a document is found from
+    its index alone and a shard can be read sequentially from start to end. The corpus is streamed line by line twice,
+    once to count the words and once to write the word ids, so memory use does not depend on the size of the corpus.
+    With max_vocab_size the vocabulary is pruned while counting.
+    The cache lives in a directory named after the content hash of the corpus and the tokenizer settings, so a changed
+    corpus or tokenizer never picks up stale tokens. Later runs memory-map the arrays and skip parsing entirely.
+'''
+
+CACHE_VERSION   = 3
+BATCH_SIZE      = 1000
+SHARD_DOCUMENTS = 100000
+
+# documents read at once when a shard is streamed
+READ_DOCUMENTS  = 1000
+
+
+class CorpusCache:
+
+    def __init__(self, corpus_path, max_vocab_size=None, cache_dir=None, shard_documents=SHARD_DOCUMENTS):
+
+        self.corpus_path     = corpus_path
+        self.max_vocab_size  = max_vocab_size
+        self.shard_documents = shard_documents
+        self.cache_dir       = corpus_path + '.cache' if cache_dir is None else cache_dir
+        self.key             = self.cacheKey()
+        self.path            = os.path.join(self.cache_dir, self.key)
+
+        if not os.path.isdir(self.path):
+            print("Building corpus cache " + self.path)
+            self.build()
+
+        self.load()
+
+
+    def __len__(self):
+        return self.num_documents
+
+
+    # memory maps are reopened instead of copied when the cache is sent to a spawned worker process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['shard_tokens'], state['shard_offsets']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.load()
+
+
+    # word ids of a single document
+    def document(self, index):
+        shard, index = divmod(index, self.shard_documents)
+        offsets = self.shard_offsets[shard]
+        return self.shard_tokens[shard][offsets[index]:offsets[index+1]]
+
+
+    # index of the first document of every shard, followed by the number of documents
+    def shardBoundaries(self):
+        return [min(shard * self.shard_documents, self.num_documents) for shard in range(0, self.num_shards + 1)]
+
+
+    # word ids of the documents start .. stop-1 of a shard (indices within the shard) in order; the shard is read
+    # sequentially in chunks of READ_DOCUMENTS documents
+    def iterShard(self, shard, start, stop):
+
+        offsets = self.shard_offsets[shard]
+        tokens  = self.shard_tokens[shard]
+
+        for chunk_start in range(start, stop, READ_DOCUMENTS):
+            chunk_stop    = min(chunk_start + READ_DOCUMENTS, stop)
+            chunk_offsets = np.array(offsets[chunk_start:chunk_stop + 1])
+            chunk_tokens  = np.array(tokens[chunk_offsets[0]:chunk_offsets[-1]])
+            chunk_offsets = chunk_offsets - chunk_offsets[0]
+            for i in range(0, chunk_stop - chunk_start):
+                yield chunk_tokens[chunk_offsets[i]:chunk_offsets[i+1]]
+
+
+    # content hash of the corpus combined with everything that influences the token stream
+    def cacheKey(self):
+
+        digest = hashlib.sha1()
+
+        with open(self.corpus_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+
+        digest.update('tokenizer_{}_cache_{}_vocab_{}_shard_{}'.format(tokenizer.TOKENIZER_VERSION,
+                                                                       CACHE_VERSION,
+                                                                       self.max_vocab_size,
+                                                                       self.shard_documents).encode('ascii'))
+
+        return digest.hexdigest()
+
+
+    # tokenize the corpus in two streaming passes and write the cache files
+    def build(self):
+
+        tmp_path = self.path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        # first pass: count words with bounded memory
+        counter = VocabularyCounter(self.max_vocab_size)
+        for batch in iterNdJson(self.corpus_path, BATCH_SIZE):
+            for text in tokenizer.tokenizeDocuments(batch):
+                counter.add(text)
+
+        words     = [w for w, c in counter.vocabulary()]
+        word2id   = {w: i for i, w in enumerate(words)}
+        frequency = np.zeros((len(words),), dtype=np.int64)
+
+        num_documents      = 0
+        num_tokens         = 0
+        max_num_words_file = 0
+
+        # second pass: write the word ids of every document, words pruned while counting are left out
+        shard_tokens = list()
+        writer       = ShardWriter(tmp_path, 0)
+
+        for batch in iterNdJson(self.corpus_path, BATCH_SIZE):
+
+            texts        = tokenizer.tokenizeDocuments(batch)
+            ids, offsets = tokenizer.encodeTokens(texts, word2id)
+            frequency   += np.bincount(ids, minlength=len(words))
+
+            # the documents of a batch may be spread over several shards
+            start = 0
+            while start < len(texts):
+                if writer.num_documents == self.shard_documents:
+                    shard_tokens.append(writer.close())
+                    writer = ShardWriter(tmp_path, len(shard_tokens))
+                stop = min(len(texts), start + self.shard_documents - writer.num_documents)
+                writer.write(ids[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start])
+                start = stop
+
+            num_documents     += len(texts)
+            num_tokens        += len(ids)
+            max_num_words_file = max([max_num_words_file] + [len(text) for text in texts])
+
+        shard_tokens.append(writer.close())
+
+        with open(os.path.join(tmp_path, 'words.json'), 'w', encoding="utf8") as f:
+            json.dump({'words': words, 'frequency': frequency.tolist()}, f)
+
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'corpus':             os.path.basename(self.corpus_path),
+                       'max_vocab_size':     self.max_vocab_size,
+                       'num_documents':      num_documents,
+                       'num_tokens':         num_tokens,
+                       'token_count':        counter.token_count,
+                       'max_num_words_file': max_num_words_file,
+                       'shard_documents':    self.shard_documents,
+                       'shard_tokens':       shard_tokens}, f)
+
+        os.replace(tmp_path, self.path)
+
+
+    # memory-map the cache files
+    def load(self):
+
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        with open(os.path.join(self.path, 'words.json'), encoding="utf8") as f:
+            vocab = json.load(f)
+
+        self.num_documents      = meta['num_documents']
+        self.num_tokens         = meta['num_tokens']
+        self.token_count        = meta['token_count']
+        self.max_num_words_file = meta['max_num_words_file']
+        self.num_shards         = len(meta['shard_tokens'])
+
+        self.words     = vocab['words']
+        self.frequency = vocab['frequency']
+
+        self.shard_offsets = list()
+        self.shard_tokens  = list()
+
+        boundaries = self.shardBoundaries()
+
+        for shard, num_shard_tokens in enumerate(meta['shard_tokens']):
+
+            num_shard_documents = boundaries[shard + 1] - boundaries[shard]
+            self.shard_offsets.append(np.memmap(shardPath(self.path, shard, 'offsets'), dtype=np.int64, mode='r',
+                                                shape=(num_shard_documents + 1,)))
+
+            self.shard_tokens.append(np.zeros((0,), dtype=np.int32))
+            if num_shard_tokens > 0:
+                self.shard_tokens[shard] = np.memmap(shardPath(self.path, shard, 'tokens'), dtype=np.int32, mode='r',
+                                                     shape=(num_shard_tokens,))
+
+
+# file of a shard in the cache directory
+def shardPath(path, shard, name):
+    return os.path.join(path, 'shard_{0:05d}.{1}.bin'.format(shard, name))
+
+
+# appends documents to the token and offset files of a single shard
+class ShardWriter:
+
+    def __init__(self, path, shard):
+
+        self.tokens_out    = open(shardPath(path, shard, 'tokens'), 'wb')
+        self.offsets_out   = open(shardPath(path, shard, 'offsets'), 'wb')
+        self.num_documents = 0
+        self.num_tokens    = 0
+
+        np.zeros((1,), dtype=np.int64).tofile(self.offsets_out)
+
+
+    # word ids of consecutive documents and their offsets, starting at 0
+    def write(self, ids, offsets):
+        ids.tofile(self.tokens_out)
+        (offsets[1:] + self.num_tokens).tofile(self.offsets_out)
+        self.num_documents += len(offsets) - 1
+        self.num_tokens    += len(ids)
+
+
+    # close the files and return the number of tokens of the shard
+    def close(self):
+        self.tokens_out.close()
+        self.offsets_out.close()
+        return self.num_tokens
+
+
+# read a ndjson file line by line and yield lists of at most batch_size documents
+def iterNdJson(path, batch_size):
+
+    batch = list()
+
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = list()
+
+    if len(batch) > 0:
+        yield batch
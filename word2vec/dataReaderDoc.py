@@ -1,22 +1,27 @@
 import numpy as np
 import torch
 import time
-import random
 import ndjson
-import jsonlines
-from torch.utils.data import Dataset
-from utilities import utilities
+from torch.utils.data import IterableDataset, get_worker_info
+from utilities import tokenizer
+from word2vec.corpusCache import CorpusCache, SHARD_DOCUMENTS
+from word2vec.vocabulary import VocabularyCounter
+from word2vec.pairGenerator import skipGramPairs, cbowExamples, emptyPairs, concatenatePairs, numPairs, splitPairs
+from word2vec.negativeSampler import NegativeSampler
 
 np.random.seed(12345)
 
+NEGATIVE_TABLE_SIZE = 1e5
+
 class DataReader:
-    NEGATIVE_TABLE_SIZE = 1e5
 
-    def __init__(self, primary_files, min_count, supporting_files=None):
+    def __init__(self, primary_files, min_count, supporting_files=None, max_vocab_size=None,
+                 neg_table_size=NEGATIVE_TABLE_SIZE, neg_power=0.5, shard_documents=SHARD_DOCUMENTS):
 
-        self.negatives = []
-        self.discards  = []
-        self.negpos    = 0
+        self.sampler        = None
+        self.discards       = []
+        self.neg_table_size = neg_table_size
+        self.neg_power      = neg_power
 
         self.word2id        = dict()
         self.id2word        = dict()
@@ -27,15 +32,17 @@ class DataReader:
 
         self.primary_files      = primary_files
         self.supporting_files   = supporting_files
+        self.max_vocab_size     = max_vocab_size
+        self.shard_documents    = shard_documents
 
         self.file_paths = primary_files if supporting_files is None else primary_files + supporting_files
         
-        self.data = None
+        self.ndjson = self.ndJson(primary_files)
+        self.corpus = None
+        self.remap  = None
 
-        if self.ndJson:
-            with open(self.primary_files) as f:
-                self.data = ndjson.load(f)
-            self.readWordsNdJson(min_count)
+        if self.ndjson:
+            self.readWordsCorpusCache(min_count)
         else:
             self.readWords(min_count)
             
@@ -44,49 +51,43 @@ class DataReader:
 
 
     def ndJson(self, primary_files):
-        if len(primary_files) == 1 and '.ndjson' in primary_files:
+        if isinstance(primary_files, str) and primary_files.endswith('.ndjson'):
             return True
         else:
             return False
-            
-    
-    def getTextNdJson(self, index):
-    
-        address    = utilities.parseLine(self.data[index]['address'][0]['prettyPrint']) 
-        text_array = utilities.parseLine(self.data[index]['text']).replace(address, 'address').split(' ') 
 
-        result = list()
-        
-        for item in text_array:
-            if len(item) > 0:
-                result.append(item)
-                
-        self.data[index]['text_array'] = result  
 
+    # word ids of a ndjson document, words below min_count are left out
+    def getDocument(self, index):
+        return self.remapDocument(self.corpus.document(index))
 
-    # read words and create word2id and id2word lookup tables
-    def readWordsNdJson(self, min_count):
+    # translate the ids of the corpus cache to training ids
+    def remapDocument(self, ids):
+        ids = self.remap[ids]
+        return ids[ids >= 0]
+
+
+    # read words from the pre-tokenized corpus and create word2id and id2word lookup tables
+    def readWordsCorpusCache(self, min_count):
 
         print("Setting up word2vec training")
-        word_frequency = dict()
 
-        for i in range(0, 5000):
+        self.corpus             = CorpusCache(self.primary_files, self.max_vocab_size,
+                                              shard_documents=self.shard_documents)
+        self.token_count        = self.corpus.token_count
+        self.max_num_words_file = self.corpus.max_num_words_file
 
-            word_count = 0            
-            self.getTextNdJson(i)
-            
-            for word in self.data[i]['text_array']:
-                word_count += 1
-                self.token_count += 1
-                word_frequency[word] = word_frequency.get(word, 0) + 1
+        # maps the ids of the cache to the ids used for training
+        self.remap = np.full((len(self.corpus.words),), -1, dtype=np.int64)
 
         wid = 0
-        for w, c in word_frequency.items():
+        for cid, (w, c) in enumerate(zip(self.corpus.words, self.corpus.frequency)):
             if c < min_count:
                 continue
             self.word2id[w] = wid
             self.id2word[wid] = w
             self.word_frequency[wid] = c
+            self.remap[cid] = wid
             wid += 1
 
         print("Read " + str(self.token_count) + " words.\n")
@@ -96,25 +97,23 @@ class DataReader:
     # read words and create word2id and id2word lookup tables
     def readWords(self, min_count):
         print("Setting up word2vec training")
-        word_frequency = dict()
+        counter = VocabularyCounter(self.max_vocab_size)
         for file in self.file_paths:
             word_count = 0
-            for line in open(file, encoding="utf8"):
-                line = utilities.parseLine(line).split()
-                if len(line) > 1:
-                    for word in line:
-                        word_count += 1
-                        if len(word) > 0:
-                            self.token_count += 1
-                            word_frequency[word] = word_frequency.get(word, 0) + 1
+            with open(file, encoding="utf8") as f:
+                for line in f:
+                    line = tokenizer.tokenizeLine(line)
+                    if len(line) > 1:
+                        word_count += len(line)
+                        counter.add(line)
 
             if word_count > self.max_num_words_file and file in self.primary_files :
                 self.max_num_words_file = word_count
 
+        self.token_count = counter.token_count
+
         wid = 0
-        for w, c in word_frequency.items():
-            if c < min_count:
-                continue
+        for w, c in counter.vocabulary(min_count):
             self.word2id[w] = wid
             self.id2word[wid] = w
             self.word_frequency[wid] = c
@@ -124,82 +123,316 @@ class DataReader:
         print("Total embeddings: " + str(len(self.word2id))+ '\n')
 
 
+    # put the words of a previous vocabulary in front of the current one so that they keep their ids, words seen for
+    # the first time are appended; frequencies and token counts of both are added up
+    def mergeVocabulary(self, words, frequency, token_count, max_num_words_file):
+
+        old_ids   = {w: wid for wid, w in enumerate(words)}
+        merged    = list(words)
+        frequency = list(frequency)
+
+        # current id -> id in the merged vocabulary
+        mapping = np.zeros((len(self.id2word),), dtype=np.int64)
+
+        for wid in range(0, len(self.id2word)):
+            w = self.id2word[wid]
+            if w in old_ids:
+                mapping[wid] = old_ids[w]
+                frequency[old_ids[w]] += self.word_frequency[wid]
+            else:
+                mapping[wid] = len(merged)
+                merged.append(w)
+                frequency.append(self.word_frequency[wid])
+
+        self.word2id        = {w: wid for wid, w in enumerate(merged)}
+        self.id2word        = {wid: w for wid, w in enumerate(merged)}
+        self.word_frequency = {wid: c for wid, c in enumerate(frequency)}
+
+        if self.remap is not None:
+            known             = self.remap >= 0
+            self.remap[known] = mapping[self.remap[known]]
+
+        self.token_count        += token_count
+        self.max_num_words_file  = max(self.max_num_words_file, max_num_words_file)
+
+        print("Merged vocabulary: {} known words, {} new words\n".format(len(words), len(merged) - len(words)))
+
+        self.initTableNegatives()
+        self.initTableDiscards()
+
+
     def initTableDiscards(self):
         t = 0.0001
         f = np.array(list(self.word_frequency.values())) / self.token_count
         self.discards = np.sqrt(t / f) + (t / f)
 
 
-    # unigram distribution?
+    # unigram distribution raised to neg_power
     def initTableNegatives(self):
-        pow_frequency = np.array(list(self.word_frequency.values())) ** 0.5
-        words_pow = sum(pow_frequency)
-        ratio = pow_frequency / words_pow
-        count = np.round(ratio * DataReader.NEGATIVE_TABLE_SIZE)
-        for wid, c in enumerate(count):
-            self.negatives += [wid] * int(c)
-        self.negatives = np.array(self.negatives)
-        np.random.shuffle(self.negatives)
-
-    def getNegatives(self, target, size):
-        response = self.negatives[self.negpos:self.negpos + size]
-        self.negpos = (self.negpos + size) % len(self.negatives)
-        if len(response) != size:
-            return np.concatenate((response, self.negatives[0:self.negpos]))
-        return response
+        self.sampler = NegativeSampler(list(self.word_frequency.values()), self.neg_table_size, self.neg_power)
+
+    def getNegatives(self, size, rng=np.random):
+        return self.sampler.sample(size, rng)
 
 # -----------------------------------------------------------------------------------------------------------------
 
-class Word2vecDataset(Dataset):
-    def __init__(self, data, window_size, custom_files=None):
-        self.data        = data
-        self.window_size = window_size
-        self.files       = data.file_paths if custom_files is None else custom_files
-        self.num_files   = 5000
+''' Iterates over the documents of the corpus in a new random order every epoch. With several DataLoader workers the
+    permutation of an epoch is shared by all workers and split between them, so every document is visited exactly
+    once per epoch. Each worker draws subsampling, window boundaries and negatives from its own RandomState seeded
+    with (seed, epoch, worker id). With cbow the dataset yields CBOW examples (context bags and their centre word)
+    instead of skip-gram pairs. Without pairs_per_batch the dataset yields the pairs of one document at a time and the
+    DataLoader batches documents; with pairs_per_batch it yields collated batches of exactly that many pairs, taken
+    from consecutive documents, and is used with batch_size=None.
+    With shuffle_buffer a ndjson corpus is streamed instead of read in a random order: the shards of the corpus cache
+    are visited in a random order, every worker reads its own contiguous block of each shard sequentially, and the
+    documents pass through a buffer of shuffle_buffer documents from which they are drawn at random. Resident memory is
+    then bounded by the buffer, however large the corpus is.
+'''
+
+class Word2vecDataset(IterableDataset):
+    def __init__(self, data, window_size, custom_files=None, seed=12345, num_negatives=5, shared_negatives=0,
+                 cbow=False, documents=None, pairs_per_batch=None, shuffle_buffer=None):
+        self.data             = data
+        self.shuffle_buffer   = shuffle_buffer if data.ndjson else None
+        self.pairs_per_batch  = pairs_per_batch
+        self.cbow             = cbow
+        self.window_size      = window_size
+        self.num_negatives    = num_negatives
+        self.shared_negatives = shared_negatives
+        self.neg_weight       = num_negatives / shared_negatives if shared_negatives > 0 else 1.0
+        self.files            = data.file_paths if custom_files is None else custom_files
+        self.documents        = self.documentIndices(documents)
+        self.num_files        = len(self.documents) if self.documents is not None else self.totalDocuments()
+        self.selected         = self.selectedDocuments()
+        self.seed             = seed
+        self.epoch            = 0
+        self.rng              = np.random
+        self.shard            = None
 
     def __len__(self):
-        return 5000 #numdocuments
+        return self.num_files
 
-    def __getitem__(self, idx):
+    def totalDocuments(self):
+        return len(self.data.corpus) if self.data.ndjson else len(self.files)
 
-        findex = random.randint(0, self.num_files-1)
-        
-        if self.data.ndJson:              
-            words = self.data.data[findex]['text_array'] 
-            if len(words) > 1:   
-            
-                word_ids = [self.data.word2id[w] for w in words if
-                            w in self.data.word2id and np.random.rand() < self.data.discards[self.data.word2id[w]]]
-  
-                boundary = np.random.randint(1, self.window_size)
-  
-                return [(u, v, self.data.getNegatives(v, 5)) for i, u in enumerate(word_ids) for j, v in
-                        enumerate(word_ids[max(i - boundary, 0):i + boundary]) if u != v]            
-        else:    
-            file = open(self.files[findex], 'r', encoding='utf8')
-
-            while True:
-                line = file.readline()
-                if not line:
-                    self.file.seek(0, 0)
-                    line = file.readline()
-      
-                if len(line) > 1:
-                    words = utilities.parseLine(line).split()
-      
-                    if len(words) > 1:
-                        word_ids = [self.data.word2id[w] for w in words if
-                                    w in self.data.word2id and np.random.rand() < self.data.discards[self.data.word2id[w]]]
-      
-                        boundary = np.random.randint(1, self.window_size)
-      
-                        return [(u, v, self.data.getNegatives(v, 5)) for i, u in enumerate(word_ids) for j, v in
-                                enumerate(word_ids[max(i - boundary, 0):i + boundary]) if u != v]
-
-    @staticmethod
-    def collate(batches):
-        all_u = [u for batch in batches for u, _, _ in batch if len(batch) > 0]
-        all_v = [v for batch in batches for _, v, _ in batch if len(batch) > 0]
-        all_neg_v = [neg_v for batch in batches for _, _, neg_v in batch if len(batch) > 0]
-
-        return torch.LongTensor(all_u), torch.LongTensor(all_v), torch.LongTensor(all_neg_v)
+    # indices of the documents (ndjson) or files (text) the dataset iterates over, all of them by default; a streamed
+    # corpus does not need the indices unless only part of it is used
+    def documentIndices(self, documents):
+        if documents is not None:
+            return np.asarray(documents, dtype=np.int64)
+        if self.shuffle_buffer is not None:
+            return None
+        return np.arange(self.totalDocuments(), dtype=np.int64)
+
+    # mask of the documents of a streamed corpus that belong to the dataset, None if all of them do
+    def selectedDocuments(self):
+        if self.shuffle_buffer is None or self.num_files == self.totalDocuments():
+            return None
+        selected = np.zeros((self.totalDocuments(),), dtype=bool)
+        selected[self.documents] = True
+        return selected
+
+    # needed when workers are not persistent, they receive a fresh copy of the dataset every epoch
+    def setEpoch(self, epoch):
+        self.epoch = epoch
+
+    # split the documents between processes that do not run as DataLoader workers (e.g. hogwild training)
+    def setShard(self, worker_id, num_workers):
+        self.shard = (worker_id, num_workers)
+
+    # worker id and number of workers of the current process
+    def workerInfo(self):
+
+        info        = get_worker_info()
+        worker_id   = 0 if info is None else info.id
+        num_workers = 1 if info is None else info.num_workers
+
+        if self.shard is not None:
+            worker_id, num_workers = self.shard
+
+        return worker_id, num_workers
+
+    # documents of this epoch that belong to the current worker
+    def workerDocuments(self):
+
+        worker_id, num_workers = self.workerInfo()
+
+        order    = self.documents[np.random.RandomState([self.seed, self.epoch]).permutation(self.num_files)]
+        self.rng = np.random.RandomState([self.seed, self.epoch, worker_id])
+
+        return order[worker_id::num_workers]
+
+    # number of documents each of num_workers workers yields in an epoch, following workerDocuments and workerBlocks
+    def workerDocumentCounts(self, num_workers):
+
+        if self.shuffle_buffer is None:
+            return [len(range(worker_id, self.num_files, num_workers)) for worker_id in range(0, num_workers)]
+
+        corpus     = self.data.corpus
+        boundaries = corpus.shardBoundaries()
+        counts     = [0] * num_workers
+
+        for shard in range(0, corpus.num_shards):
+            size = boundaries[shard + 1] - boundaries[shard]
+            for worker_id in range(0, num_workers):
+                start, stop = size * worker_id // num_workers, size * (worker_id + 1) // num_workers
+                if self.selected is None:
+                    counts[worker_id] += stop - start
+                else:
+                    counts[worker_id] += int(self.selected[boundaries[shard] + start:boundaries[shard] + stop].sum())
+
+        return counts
+
+    # (shard, start, stop) blocks of this epoch that belong to the current worker: the shards in a random order,
+    # every shard split into one contiguous block per worker
+    def workerBlocks(self):
+
+        worker_id, num_workers = self.workerInfo()
+
+        corpus     = self.data.corpus
+        boundaries = corpus.shardBoundaries()
+        order      = np.random.RandomState([self.seed, self.epoch]).permutation(corpus.num_shards)
+        self.rng   = np.random.RandomState([self.seed, self.epoch, worker_id])
+
+        blocks = list()
+        for shard in order:
+            size = boundaries[shard + 1] - boundaries[shard]
+            blocks.append((shard, size * worker_id // num_workers, size * (worker_id + 1) // num_workers))
+
+        return blocks
+
+    # word ids of the documents of the given blocks, in the order they are stored
+    def streamDocuments(self, blocks):
+
+        corpus = self.data.corpus
+
+        for shard, start, stop in blocks:
+            first = shard * corpus.shard_documents
+            for index, ids in enumerate(corpus.iterShard(shard, start, stop), first + start):
+                if self.selected is None or self.selected[index]:
+                    yield self.data.remapDocument(ids)
+
+    # draw documents at random from a buffer that is refilled from the stream
+    def shuffleDocuments(self, documents):
+
+        buffer = list()
+
+        for words in documents:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(words)
+                continue
+            slot         = self.rng.randint(len(buffer))
+            drawn        = buffer[slot]
+            buffer[slot] = words
+            yield drawn
+
+        for slot in self.rng.permutation(len(buffer)):
+            yield buffer[slot]
+
+    def __iter__(self):
+
+        if self.shuffle_buffer is not None:
+            documents = self.shuffleDocuments(self.streamDocuments(self.workerBlocks()))
+            pairs     = (self.documentExamples(words) for words in documents)
+        else:
+            pairs     = (self.documentPairs(findex) for findex in self.workerDocuments())
+
+        self.epoch += 1
+
+        if self.pairs_per_batch is not None:
+            yield from self.fixedBatches(pairs)
+        else:
+            yield from pairs
+
+    # re-chunk the pairs of consecutive documents into batches of exactly pairs_per_batch pairs, the remainder of a
+    # document is carried into the next batch; only the last batch of an epoch can be smaller
+    def fixedBatches(self, document_pairs):
+
+        pending     = list()
+        num_pending = 0
+
+        for pairs in document_pairs:
+
+            num_pending += numPairs(pairs)
+            pending.append(pairs)
+
+            if num_pending < self.pairs_per_batch:
+                continue
+
+            # a long document can fill several batches, they are sliced from a single concatenation
+            pairs = concatenatePairs(pending)
+            while numPairs(pairs) >= self.pairs_per_batch:
+                batch, pairs = splitPairs(pairs, self.pairs_per_batch)
+                yield self.collate([batch])
+
+            pending     = [pairs]
+            num_pending = numPairs(pairs)
+
+        if num_pending > 0:
+            yield self.collate(pending)
+
+    # expected number of fixed size batches per epoch: the tokens kept by subsampling, each paired with window_size - 1
+    # context words on average (the boundary is uniform in [1, window_size)), or one CBOW example per kept token
+    def estimateBatches(self):
+
+        frequency = np.array(list(self.data.word_frequency.values()), dtype=np.float64)
+        kept      = float(np.dot(np.minimum(self.data.discards, 1.0), frequency))
+        kept      = kept * self.num_files / max(1, self.totalDocuments())
+        pairs     = kept if self.cbow else kept * (self.window_size - 1)
+
+        return max(1, int(np.ceil(pairs / self.pairs_per_batch)))
+
+    # all training pairs (or CBOW examples) of a single document
+    def documentPairs(self, findex):
+
+        if self.data.ndjson:
+            return self.documentExamples(self.data.getDocument(findex))
+
+        # text files: every line is a sentence of its own
+        pairs = [self.emptyExamples()]
+        with open(self.files[findex], 'r', encoding='utf8') as file:
+            for line in file:
+                words = tokenizer.tokenizeLine(line)
+                if len(words) > 1:
+                    word_ids = [self.data.word2id[w] for w in words if w in self.data.word2id]
+                    pairs.append(self.windowExamples(word_ids))
+
+        return concatenatePairs(pairs)
+
+    def documentExamples(self, word_ids):
+        if len(word_ids) > 1:
+            return self.windowExamples(word_ids)
+        return self.emptyExamples()
+
+    def windowExamples(self, word_ids):
+        if self.cbow:
+            return cbowExamples(word_ids, self.data.discards, self.window_size, rng=self.rng)
+        return skipGramPairs(word_ids, self.data.discards, self.window_size, rng=self.rng)
+
+    def emptyExamples(self):
+        return emptyPairs(3 if self.cbow else 2)
+
+
+    # negatives for all pairs of the batch are drawn in a single call; with shared_negatives the batch gets one
+    # pool of that many negatives instead of num_negatives per pair, the model then weighs the negative term with
+    # neg_weight so that every pair still counts num_negatives negatives on average
+    def collate(self, batches):
+
+        # CBOW batches start with the flat context words and the offset of every bag, like nn.EmbeddingBag expects
+        if self.cbow:
+            all_context, all_lengths, all_v = concatenatePairs(batches)
+            offsets = np.zeros((len(all_lengths),), dtype=np.int64)
+            np.cumsum(all_lengths[:-1], out=offsets[1:])
+            inputs  = (torch.from_numpy(all_context), torch.from_numpy(offsets))
+        else:
+            all_u, all_v = concatenatePairs(batches)
+            inputs = (torch.from_numpy(all_u),)
+
+        if self.shared_negatives > 0:
+            all_neg_v = self.data.getNegatives(self.shared_negatives, self.rng)
+            return inputs + (torch.from_numpy(all_v), torch.from_numpy(all_neg_v))
+
+        all_neg_v = self.data.getNegatives(len(all_v) * self.num_negatives, self.rng)
+
+        return inputs + (torch.from_numpy(all_v),
+                         torch.from_numpy(all_neg_v.reshape(len(all_v), self.num_negatives)))
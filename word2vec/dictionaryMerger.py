@@ -1,6 +1,7 @@
 import torch
 import numpy as np
 from utilities.utilities import *
+from utilities.vectorStore import readVectorStore, writeVectorsText, readKeywordIds, writeKeywordIds, removeKeywordIds
 
 ''' This class takes both primary and secondary dictionary files (e.g. colours and documents)
     and replaces specific vectors in the primary dictionary with their equivalents in the secondary dictionary.
@@ -16,13 +17,18 @@ class DictionaryMerger:
 
         self.output_file_path = output_file_path
 
-        self.dict1, params = readVectorsDict(primary_dict_file_path)
-        self.dict2, params = readVectorsDict(secondary_dict_file_path)
-        self.new_dict      = self.dict1
+        self.dict1 = readVectorStore(primary_dict_file_path)
+        self.dict2 = readVectorStore(secondary_dict_file_path)
 
-        self.unique_vectors = params[0]
-        self.vector_size    = params[1]
-        self.max_file_size  = params[2]
+        # keyword channel of the primary dictionary, the rows keep their order
+        self.keyword_ids = readKeywordIds(primary_dict_file_path)
+
+        self.words      = self.dict1.words
+        self.new_matrix = np.array(self.dict1.matrix)
+
+        self.unique_vectors = self.dict1.num_vectors
+        self.vector_size    = self.dict1.vector_size
+        self.max_file_size  = self.dict1.max_num_words_file
 
         self.replacement_table = readKeyTable(replacement_table_file_path)
 
@@ -30,14 +36,14 @@ class DictionaryMerger:
     # create a new dictionary by replacing the vectors
     def replaceVectors(self):
         for item in self.replacement_table:
-            if item in self.new_dict:
-                self.new_dict[item] = self.dict2[item]
+            if item in self.dict1:
+                self.new_matrix[self.dict1.word2row[item]] = self.dict2[item]
 
 
-    # write new dictionary to file
+    # write new dictionary to file together with the keyword channel of the primary dictionary (or without any)
     def writeVectors(self):
-        with open(self.output_file_path, 'w') as f:
-            f.write('%d %d %d\n' % (self.unique_vectors, self.vector_size, self.max_file_size))
-            for item in self.new_dict:
-                vec = ' '.join(map(lambda x: str(x), self.new_dict[item]))
-                f.write('%s %s\n' % (item, vec))
\ No newline at end of file
+        writeVectorsText(self.output_file_path, self.words, self.new_matrix, self.max_file_size)
+        if self.keyword_ids is None:
+            removeKeywordIds(self.output_file_path)
+        else:
+            writeKeywordIds(self.output_file_path, self.keyword_ids)
@@ -0,0 +1,37 @@
+''' Convergence check on the held-out loss. An evaluation counts as an improvement if the loss drops by at least
+    min_delta below the best loss so far; training stops after patience evaluations in a row without improvement.
+    With patience 1 training stops as soon as a single evaluation improves by less than min_delta.
+'''
+
+class EarlyStopping:
+
+    def __init__(self, min_delta=1e-3, patience=3):
+
+        self.min_delta = min_delta
+        self.patience  = patience
+
+        self.best       = float('inf')
+        self.best_epoch = None
+        self.num_bad    = 0
+        self.history    = list()
+        self.reason     = None
+
+
+    # record the held-out loss after the given epoch, returns True when training should stop
+    def step(self, epoch, loss):
+
+        self.history.append((epoch, loss))
+
+        if loss < self.best - self.min_delta:
+            self.best       = loss
+            self.best_epoch = epoch
+            self.num_bad    = 0
+            return False
+
+        self.num_bad += 1
+        if self.num_bad < self.patience:
+            return False
+
+        self.reason = "held-out loss improved by less than {} for {} evaluations, best {:.4f} after epoch {}".format(
+            self.min_delta, self.patience, self.best, self.best_epoch)
+        return True
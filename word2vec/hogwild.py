@@ -0,0 +1,103 @@
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+''' Hogwild training of the skip-gram model on CPU. The embedding tables are moved into shared memory and every
+    worker process trains on its own shard of the documents, applying plain SGD updates to the rows touched by its
+    batch without any locking. As in the original word2vec implementation the learning rate decays linearly from
+    initial_lr to MIN_LR_FRACTION * initial_lr over the total number of documents of all epochs; the progress
+    counter is shared by all workers. Losses are summed per step, so initial_lr is the per-pair SGD learning rate.
+'''
+
+MIN_LR_FRACTION = 1e-4
+
+
+def hogwildWorker(rank, num_processes, model, dataset, batch_size, num_epochs, initial_lr,
+                  progress, loss_sums, step_counts, pair_counts):
+
+    # every process gets one core, parallelism comes from the processes
+    torch.set_num_threads(1)
+
+    dataset.setShard(rank, num_processes)
+    total_work = float(num_epochs * dataset.num_files)
+
+    for epoch in range(num_epochs):
+
+        dataset.setEpoch(epoch)
+        batch = list()
+
+        for pairs in dataset:
+
+            batch.append(pairs)
+            if len(batch) < batch_size:
+                continue
+
+            # batches end with (pos_v, neg_v), the model inputs in front of them depend on the architecture
+            tensors         = dataset.collate(batch)
+            num_pairs       = len(tensors[-2])
+            progress.value += len(batch)
+            batch           = list()
+
+            if num_pairs < 2:
+                continue
+
+            lr   = initial_lr * max(MIN_LR_FRACTION, 1.0 - progress.value / total_work)
+            loss = model.forward(*tensors, dataset.neg_weight)
+
+            model.zero_grad()
+            (loss * num_pairs).backward()
+
+            # lock-free sparse update of the rows in shared memory
+            with torch.no_grad():
+                for param in model.parameters():
+                    if param.grad is not None:
+                        param.index_add_(0, param.grad._indices()[0], param.grad._values(), alpha=-lr)
+
+            index = rank * num_epochs + epoch
+            loss_sums[index]   += loss.item()
+            step_counts[index] += 1
+            pair_counts[index] += num_pairs
+
+        # leftover documents of the epoch only count towards the progress
+        progress.value += len(batch)
+
+
+# train the model with num_processes hogwild workers and return the mean loss of every epoch
+def trainHogwild(model, dataset, num_epochs, num_processes, batch_size, initial_lr):
+
+    # sparse gradients left over from earlier training cannot be moved into shared memory
+    model.zero_grad(set_to_none=True)
+    model.share_memory()
+
+    progress    = mp.RawValue('d', 0.0)
+    loss_sums   = mp.RawArray('d', num_processes * num_epochs)
+    step_counts = mp.RawArray('l', num_processes * num_epochs)
+    pair_counts = mp.RawArray('l', num_processes * num_epochs)
+
+    start     = time.time()
+    processes = list()
+
+    for rank in range(0, num_processes):
+        process = mp.Process(target=hogwildWorker, args=(rank, num_processes, model, dataset, batch_size, num_epochs,
+                                                         initial_lr, progress, loss_sums, step_counts, pair_counts))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+    for process in processes:
+        if process.exitcode != 0:
+            raise RuntimeError("Hogwild worker failed with exit code {}".format(process.exitcode))
+
+    elapsed = time.time() - start
+
+    loss_sums   = np.asarray(loss_sums).reshape(num_processes, num_epochs).sum(axis=0)
+    step_counts = np.asarray(step_counts).reshape(num_processes, num_epochs).sum(axis=0)
+    num_pairs   = int(np.asarray(pair_counts).sum())
+
+    print("Hogwild training with {} processes: {} pairs in {} seconds, {} pairs per second".format(
+        num_processes, num_pairs, round(elapsed), round(num_pairs / max(elapsed, 1e-9))))
+
+    return [float(loss) for loss in loss_sums / np.maximum(step_counts, 1)]
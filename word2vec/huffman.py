@@ -0,0 +1,64 @@
+import heapq
+import numpy as np
+
+''' Huffman tree over the vocabulary for hierarchical softmax. Frequent words get short paths, so the cost of a
+    training pair is O(log V) inner node updates instead of a number of negative samples. For every word the path from
+    the root to its leaf is returned as padded arrays:
+        points - index of every inner node on the path (0 .. V-2)
+        codes  - branch taken at that node (0 or 1)
+        mask   - 1 for real path entries, 0 for padding
+'''
+
+
+def huffmanCodes(frequencies):
+
+    num_words = len(frequencies)
+
+    # a tree needs at least two leaves, a single word gets a path of length one through a dummy node
+    if num_words < 2:
+        return (np.zeros((num_words, 1), dtype=np.int64),
+                np.zeros((num_words, 1), dtype=np.float32),
+                np.ones((num_words, 1), dtype=np.float32))
+
+    parent = np.zeros((2 * num_words - 1,), dtype=np.int64)
+    branch = np.zeros((2 * num_words - 1,), dtype=np.int64)
+
+    # the word id breaks ties so that the tree does not depend on heap internals
+    heap = [(int(count), wid) for wid, count in enumerate(frequencies)]
+    heapq.heapify(heap)
+
+    node = num_words
+    while len(heap) > 1:
+        count1, node1 = heapq.heappop(heap)
+        count2, node2 = heapq.heappop(heap)
+        parent[node1] = node
+        parent[node2] = node
+        branch[node2] = 1
+        heapq.heappush(heap, (count1 + count2, node))
+        node += 1
+
+    root  = node - 1
+    paths = list()
+
+    for wid in range(0, num_words):
+        points  = list()
+        codes   = list()
+        current = wid
+        while current != root:
+            points.append(parent[current] - num_words)
+            codes.append(branch[current])
+            current = parent[current]
+        paths.append((points[::-1], codes[::-1]))
+
+    max_depth = max(len(points) for points, _ in paths)
+
+    points = np.zeros((num_words, max_depth), dtype=np.int64)
+    codes  = np.zeros((num_words, max_depth), dtype=np.float32)
+    mask   = np.zeros((num_words, max_depth), dtype=np.float32)
+
+    for wid, (path_points, path_codes) in enumerate(paths):
+        points[wid, 0:len(path_points)] = path_points
+        codes[wid, 0:len(path_codes)]   = path_codes
+        mask[wid, 0:len(path_points)]   = 1.0
+
+    return points, codes, mask
@@ -0,0 +1,32 @@
+import numpy as np
+
+''' Unigram table for negative sampling. Every word id occurs in the table proportionally to its frequency raised to
+    the given power, so drawing uniform positions of the table draws words from the smoothed unigram distribution.
+    The table is built with a single np.repeat and all negatives of a batch are drawn with one call.
+'''
+
+class NegativeSampler:
+
+    def __init__(self, frequencies, table_size=1e5, power=0.5):
+
+        self.table_size = int(table_size)
+        self.power      = power
+
+        pow_frequency = np.asarray(frequencies, dtype=np.float64) ** power
+        ratio         = pow_frequency / pow_frequency.sum()
+        count         = np.round(ratio * self.table_size).astype(np.int64)
+
+        self.table = np.repeat(np.arange(len(count), dtype=np.int64), count)
+
+        # table too small to hold a single entry of any word, fall back to uniform sampling
+        if len(self.table) == 0:
+            self.table = np.arange(len(count), dtype=np.int64)
+
+
+    def __len__(self):
+        return len(self.table)
+
+
+    # draw size negatives in one call
+    def sample(self, size, rng=np.random):
+        return self.table[rng.randint(0, len(self.table), size)]
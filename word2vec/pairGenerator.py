@@ -0,0 +1,100 @@
+import numpy as np
+
+''' Vectorised construction of skip-gram training pairs from the word ids of a single document. The pairs are the
+    same as those of the original list comprehension
+        [(u, v) for i, u in enumerate(ids) for v in ids[max(i - boundary, 0):i + boundary] if u != v]
+    i.e. every centre word is paired with the words at offsets -boundary .. boundary-1 around it, where boundary is
+    drawn once per document from [1, window_size). Instead of looping over positions, one pass per offset selects all
+    valid (centre, context) positions at once. Pairs are ordered by centre position as before. Negatives are not part
+    of the pairs, the dataset draws them for a whole batch when the batch is collated. CBOW examples are built from
+    the same window, grouping the context words of every centre word into one bag.
+'''
+
+
+# keep every word with the probability given by the discard table (subsampling of frequent words)
+def subsample(word_ids, discards, rng=np.random):
+    return word_ids[rng.random_sample(len(word_ids)) < discards[word_ids]]
+
+
+# centre and context positions for all offsets within the window boundary
+def windowPositions(n, boundary):
+
+    positions = np.arange(n)
+
+    offsets = np.arange(-boundary, boundary)
+    offsets = offsets[offsets != 0]
+
+    centre  = np.repeat(positions[None, :], len(offsets), axis=0)
+    context = centre + offsets[:, None]
+    valid   = (context >= 0) & (context < n)
+
+    # order the pairs by centre position, then by offset, as in the nested comprehension
+    return centre.T[valid.T], context.T[valid.T]
+
+
+# centre and context word ids for all offsets within the window boundary
+def windowPairs(word_ids, boundary):
+
+    centre, context = windowPositions(len(word_ids), boundary)
+
+    pos_u = word_ids[centre]
+    pos_v = word_ids[context]
+    keep  = pos_u != pos_v
+
+    return pos_u[keep], pos_v[keep]
+
+
+# all (u, v) pairs of a document as int64 arrays, negatives are drawn per batch by the dataset
+def skipGramPairs(word_ids, discards, window_size, rng=np.random):
+
+    word_ids = subsample(np.asarray(word_ids, dtype=np.int64), discards, rng)
+    boundary = rng.randint(1, window_size)
+
+    return windowPairs(word_ids, boundary)
+
+
+# CBOW examples of a document: the context words of every centre word as one flat array, the number of context
+# words per centre (the bag lengths) and the centre words themselves. The window is the same as for skip-gram, so
+# every centre word is predicted from exactly the words it would be paired with by skipGramPairs.
+def cbowExamples(word_ids, discards, window_size, rng=np.random):
+
+    word_ids = subsample(np.asarray(word_ids, dtype=np.int64), discards, rng)
+    boundary = rng.randint(1, window_size)
+
+    centre, context = windowPositions(len(word_ids), boundary)
+
+    keep    = word_ids[centre] != word_ids[context]
+    centre  = centre[keep]
+    context = context[keep]
+
+    lengths = np.bincount(centre, minlength=len(word_ids))
+    has_bag = lengths > 0
+
+    return word_ids[context], lengths[has_bag], word_ids[has_bag]
+
+
+# empty pair (or CBOW example when size is 3) for documents that do not produce any pairs
+def emptyPairs(size=2):
+    return tuple(np.zeros((0,), dtype=np.int64) for i in range(0, size))
+
+
+# concatenate the pairs (or CBOW examples) of several documents, array by array
+def concatenatePairs(pairs):
+    return tuple(np.concatenate(arrays) for arrays in zip(*pairs))
+
+
+# number of training targets: pairs for skip-gram, centre words for CBOW
+def numPairs(pairs):
+    return len(pairs[-1])
+
+
+# split pairs (or CBOW examples) after the first size targets, both parts are views of the input arrays
+def splitPairs(pairs, size):
+
+    if len(pairs) == 2:
+        pos_u, pos_v = pairs
+        return (pos_u[0:size], pos_v[0:size]), (pos_u[size:], pos_v[size:])
+
+    context, lengths, centres = pairs
+    split = int(lengths[0:size].sum())
+    return (context[0:split], lengths[0:size], centres[0:size]), (context[split:], lengths[size:], centres[size:])
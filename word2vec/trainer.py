@@ -1,34 +1,116 @@
 import torch
 import time
+import numpy as np
 import torch.optim as optim
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
-from word2vec.dataReaderDoc import DataReader, Word2vecDataset
-from word2vec.word2vec import SkipGramModel
+from word2vec.dataReaderDoc import DataReader, Word2vecDataset, NEGATIVE_TABLE_SIZE
+from word2vec.corpusCache import SHARD_DOCUMENTS
+from word2vec.word2vec import SkipGramModel, HierarchicalSkipGramModel, CBOWModel, SubwordSkipGramModel
+from word2vec.hogwild import trainHogwild
+from word2vec.vocabulary import readVocabulary, writeVocabulary, VOCABULARY_EXTENSION
+from word2vec.checkpoint import saveCheckpoint, readCheckpoint, rngState, setRngState
+from word2vec.earlyStopping import EarlyStopping
 
-from utilities.utilities import weightInit
+from utilities.utilities import weightInit, Objective, Architecture
+from utilities.subword import MIN_N, MAX_N
 
 class Word2VecTrainer:
     def __init__(self, keyword_path, primary_files, supporting_files=None,
-                 emb_dimension=10, batch_size=32, window_size=5, initial_lr=0.1, min_count=1):
+                 emb_dimension=10, batch_size=32, window_size=5, initial_lr=0.1, min_count=1, max_vocab_size=None,
+                 num_workers=0, prefetch_factor=2, persistent_workers=False,
+                 num_negatives=5, neg_table_size=NEGATIVE_TABLE_SIZE, neg_power=0.5, shared_negatives=0,
+                 binary_export=False, background_export=False, keyword_channel=False,
+                 objective=Objective.negativeSampling,
+                 architecture=Architecture.skipGram, compile_loss=False, log_interval=100,
+                 num_buckets=0, min_n=MIN_N, max_n=MAX_N,
+                 checkpoint_path=None, checkpoint_interval=1, background_checkpoint=True,
+                 validation_fraction=0.0, eval_interval=1, num_eval_pairs=20000, min_delta=1e-3, patience=3,
+                 pairs_per_batch=None, shuffle_buffer=None, shard_documents=SHARD_DOCUMENTS):
 
         # the actual data
-        self.data = DataReader(primary_files, min_count, supporting_files)
+        self.data = DataReader(primary_files, min_count, supporting_files, max_vocab_size, neg_table_size, neg_power,
+                               shard_documents)
 
         # training hyperparameters
-        self.emb_size       = len(self.data.word2id)
-        self.emb_dimension  = emb_dimension
-        self.window_size    = window_size
-        self.batch_size     = batch_size
-        self.initial_lr     = initial_lr
-        self.iter_per_epoch = 0
+        self.emb_size         = len(self.data.word2id)
+        self.emb_dimension    = emb_dimension
+        self.window_size      = window_size
+        self.batch_size       = batch_size
+        self.initial_lr       = initial_lr
+        self.num_negatives    = num_negatives
+        self.shared_negatives = shared_negatives
+        self.objective        = objective
+        self.architecture     = architecture
+        self.iter_per_epoch   = 0
+
+        # hashed character n-grams instead of one input vector per word (num_buckets 0 disables them)
+        self.num_buckets = num_buckets
+        self.min_n       = min_n
+        self.max_n       = max_n
+
+        # execution of the training step
+        self.compile_loss = compile_loss
+        self.log_interval = log_interval
+
+        # data loading; with pairs_per_batch a mini-batch holds that many pairs instead of batch_size documents
+        self.pairs_per_batch    = pairs_per_batch
+
+        # streaming of the sharded corpus through a shuffle buffer of that many documents (None reads at random)
+        self.shuffle_buffer     = shuffle_buffer
+        self.num_workers        = num_workers
+        self.prefetch_factor    = prefetch_factor
+        self.persistent_workers = persistent_workers
+
+        # checkpoints every checkpoint_interval epochs (checkpoint_path None disables them)
+        self.checkpoint_path       = checkpoint_path
+        self.checkpoint_interval   = checkpoint_interval
+        self.background_checkpoint = background_checkpoint
+        self.checkpoint_thread     = None
+
+        # early stopping on a held-out split of the documents (validation_fraction 0 disables it)
+        self.validation_fraction = validation_fraction
+        self.eval_interval       = eval_interval
+        self.num_eval_pairs      = num_eval_pairs
+        self.min_delta           = min_delta
+        self.patience            = patience
+        self.stopper             = None
+        self.eval_neg_weight     = 1.0
+        self.stop_epoch          = None
+        self.stop_reason         = None
+
+        # embedding export; with keyword_channel keywords are exported as ids next to the dictionary instead of one-hot
+        # columns of every vector
+        self.binary_export     = binary_export
+        self.background_export = background_export
+        self.keyword_channel   = keyword_channel
+        self.export_thread     = None
 
         # init model
-        self.skip_gram_model = SkipGramModel(keyword_path, self.emb_size, self.emb_dimension)
+        self.keyword_path    = keyword_path
+        self.skip_gram_model = self.initModel(keyword_path)
         self.device          = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+    # model for the selected architecture and training objective
+    def initModel(self, keyword_path):
+        if self.num_buckets > 0:
+            if self.architecture != Architecture.skipGram or self.objective != Objective.negativeSampling:
+                raise ValueError("Subword buckets are only implemented for skip-gram with negative sampling")
+            words = [self.data.id2word[wid] for wid in range(0, self.emb_size)]
+            return SubwordSkipGramModel(keyword_path, self.emb_size, self.emb_dimension, words, self.num_buckets,
+                                        self.min_n, self.max_n)
+        if self.architecture == Architecture.cbow:
+            if self.objective != Objective.negativeSampling:
+                raise ValueError("CBOW is only implemented with negative sampling")
+            return CBOWModel(keyword_path, self.emb_size, self.emb_dimension)
+        if self.objective == Objective.hierarchicalSoftmax:
+            frequencies = list(self.data.word_frequency.values())
+            return HierarchicalSkipGramModel(keyword_path, self.emb_size, self.emb_dimension, frequencies)
+        return SkipGramModel(keyword_path, self.emb_size, self.emb_dimension)
+
+
     # return string containing information about this training session
     def toString(self):
         return "lr_{}_bs_{}_ipe_{}_embs_{}_embd_{}_win_{}".format(self.initial_lr,
@@ -39,10 +121,46 @@ class Word2VecTrainer:
                                                                   self.window_size)
 
 
+    # dataset over a specific set of files, hierarchical softmax does not need negatives
+    def initDataset(self, training_files, documents=None, pairs_per_batch=None):
+        if self.objective == Objective.hierarchicalSoftmax:
+            return Word2vecDataset(self.data, self.window_size, custom_files=training_files, num_negatives=0,
+                                   documents=documents, pairs_per_batch=pairs_per_batch,
+                                   shuffle_buffer=self.shuffle_buffer)
+        return Word2vecDataset(self.data, self.window_size, custom_files=training_files,
+                               num_negatives=self.num_negatives, shared_negatives=self.shared_negatives,
+                               cbow=self.architecture == Architecture.cbow, documents=documents,
+                               pairs_per_batch=pairs_per_batch, shuffle_buffer=self.shuffle_buffer)
+
+
     # tell the data loader to iterate over a specific set of files
-    def initDataLoader(self, training_files):
-        dataset = Word2vecDataset(self.data, self.window_size, custom_files=training_files)
-        return DataLoader(dataset, self.batch_size, shuffle=False, num_workers=0, collate_fn=dataset.collate)
+    def initDataLoader(self, training_files, documents=None):
+        dataset = self.initDataset(training_files, documents, self.pairs_per_batch)
+
+        # fixed size batches come collated from the dataset
+        if self.pairs_per_batch is None:
+            batching = dict(batch_size=self.batch_size, collate_fn=dataset.collate)
+        else:
+            batching = dict(batch_size=None)
+
+        # pinned batches can be copied to the GPU without blocking the training loop
+        pin_memory = torch.cuda.is_available()
+
+        # prefetching and persistent workers only exist for multi-process loading
+        if self.num_workers == 0:
+            return DataLoader(dataset, num_workers=0, pin_memory=pin_memory, **batching)
+
+        return DataLoader(dataset, num_workers=self.num_workers, pin_memory=pin_memory,
+                          prefetch_factor=self.prefetch_factor, persistent_workers=self.persistent_workers, **batching)
+
+
+    # number of optimizer steps per epoch; every worker collates its own last, partial batch, so len(dataloader)
+    # would undercount. Estimated for fixed size batches, train corrects it after every epoch
+    def batchesPerEpoch(self, dataloader):
+        if self.pairs_per_batch is None:
+            counts = dataloader.dataset.workerDocumentCounts(max(1, self.num_workers))
+            return sum(int(np.ceil(count / self.batch_size)) for count in counts)
+        return dataloader.dataset.estimateBatches()
 
 
     def initDevice(self):
@@ -63,48 +181,125 @@ class Word2VecTrainer:
         if init == weightInit.load:
             self.skip_gram_model.load_state_dict(torch.load(saved_model_path))
             self.skip_gram_model.eval()
-        if init == weightInit.inherit:
-            pass  # inherit from previous training session of the same class -> do nothing
+        if init == weightInit.inherit and saved_model_path is not None:
+            self.inheritModel(saved_model_path)
+        # inherit without a saved model continues from the weights of the previous training session of this trainer
 
 
-    # train word2vec model
-    def train(self, training_files, output_file, num_epochs=100, init=weightInit.fromScratch, model_path=None):
+    # continue training a saved model: its vocabulary is extended by the words of the current documents, rows of
+    # known words keep their trained values and rows of new words are initialised as usual
+    def inheritModel(self, saved_model_path):
 
-        losses     = list()
-        dataloader = self.initDataLoader(training_files)
+        words, frequency, token_count, max_num_words_file = readVocabulary(saved_model_path + VOCABULARY_EXTENSION)
+        self.data.mergeVocabulary(words, frequency, token_count, max_num_words_file)
 
-        self.weightInitialisation(init, saved_model_path=model_path)
+        self.emb_size        = len(self.data.word2id)
+        self.skip_gram_model = self.initModel(self.keyword_path)
+        self.skip_gram_model.inheritState(torch.load(saved_model_path, map_location='cpu'), len(words))
+
+
+    # save the state dict of the model and the vocabulary needed to continue training it later
+    def saveModel(self, path):
+        torch.save(self.skip_gram_model.state_dict(), path)
+        writeVocabulary(path + VOCABULARY_EXTENSION,
+                        [self.data.id2word[wid] for wid in range(0, len(self.data.id2word))],
+                        [self.data.word_frequency[wid] for wid in range(0, len(self.data.word_frequency))],
+                        self.data.token_count,
+                        self.data.max_num_words_file)
+
+
+    # train word2vec model; with resume_path the run continues from a checkpoint written by an earlier call
+    def train(self, training_files, output_file, num_epochs=100, init=weightInit.fromScratch, model_path=None,
+              resume_path=None):
+
+        # the vocabulary may change when a model is inherited, so the data loader is created afterwards
+        if resume_path is None:
+            self.weightInitialisation(init, saved_model_path=model_path)
         self.initDevice()
 
-        for iteration in tqdm(range(num_epochs)):
+        losses      = list()
+        start_epoch = 0
+
+        # with a validation split the held-out documents are left out of training
+        if self.validation_fraction > 0:
+            documents, held_out = self.splitDocuments(len(self.initDataset(training_files)))
+            dataloader   = self.initDataLoader(training_files, documents)
+            eval_batches = self.evaluationBatches(training_files, held_out)
+            self.stopper = EarlyStopping(self.min_delta, self.patience)
+        else:
+            dataloader   = self.initDataLoader(training_files)
+            self.stopper = None
+
+        # the optimizer keeps its moments over all epochs, the learning rate restarts its cosine every epoch
+        optimizer = optim.SparseAdam(self.skip_gram_model.parameters(), lr=self.initial_lr)
+        scheduler = torch.optim.lr_scheduler.CosineAnnealingWarmRestarts(optimizer,
+                                                                         T_0=max(1, self.batchesPerEpoch(dataloader)))
+
+        if resume_path is not None:
+            start_epoch, losses = self.restoreCheckpoint(resume_path, optimizer, scheduler)
+
+        if self.compile_loss:
+            self.skip_gram_model.compileLoss()
+
+        progress = tqdm(range(start_epoch, num_epochs))
 
-            optimizer = optim.SparseAdam(self.skip_gram_model.parameters(), lr=self.initial_lr)
-            scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, len(dataloader))
+        for iteration in progress:
 
+            dataloader.dataset.setEpoch(iteration)
+
+            # losses stay on the device, the host only waits for them once per logging interval
             count           = 0.0
-            running_loss    = 0.0
-            cumulative_loss = 0.0
+            running_loss    = torch.zeros((), device=self.device)
+            cumulative_loss = torch.zeros((), device=self.device)
 
             for i, sample_batched in enumerate(dataloader):
 
-                if len(sample_batched[0]) > 1:
-                    pos_u = sample_batched[0].to(self.device)
-                    pos_v = sample_batched[1].to(self.device)
-                    neg_v = sample_batched[2].to(self.device)
+                # batches end with (pos_v, neg_v), the model inputs in front of them depend on the architecture
+                if len(sample_batched[-2]) > 1:
+                    batch = [tensor.to(self.device, non_blocking=True) for tensor in sample_batched]
 
-                    scheduler.step()
                     optimizer.zero_grad()
-                    loss = self.skip_gram_model.forward(pos_u, pos_v, neg_v)
+                    loss = self.skip_gram_model.forward(*batch, dataloader.dataset.neg_weight)
                     loss.backward()
                     optimizer.step()
+                    scheduler.step()
 
-                    running_loss = running_loss * 0.9 + loss.item() * 0.1
-                    cumulative_loss += loss.item()
+                    loss             = loss.detach()
+                    running_loss     = running_loss * 0.9 + loss * 0.1
+                    cumulative_loss += loss
 
                     count += 1.0
 
-            losses.append(cumulative_loss / count)
-            self.iter_per_epoch = int(count * self.batch_size)
+                    if count % self.log_interval == 0:
+                        progress.set_postfix(loss=running_loss.item())
+
+            losses.append(cumulative_loss.item() / count)
+
+            # fixed size batches do not hold batch_size documents, the documents seen are those of the dataset; the
+            # restarts were set up with an estimated number of batches, so the cosine is restarted at the end of every
+            # epoch with the number of batches it actually had
+            if self.pairs_per_batch is None:
+                self.iter_per_epoch = int(count * self.batch_size)
+            else:
+                self.iter_per_epoch = len(dataloader.dataset)
+                scheduler.T_0       = max(1, int(count))
+                scheduler.step(0)
+
+            stop = False
+            if self.stopper is not None and (iteration + 1) % self.eval_interval == 0:
+                stop = self.stopper.step(iteration + 1, self.evaluate(eval_batches))
+
+            if self.checkpoint_path is not None and (stop or (iteration + 1) % self.checkpoint_interval == 0):
+                self.saveCheckpoint(optimizer, scheduler, iteration + 1, losses)
+
+            if stop:
+                break
+
+        self.joinCheckpoint()
+
+        self.stop_epoch  = len(losses)
+        self.stop_reason = "completed all epochs" if self.stopper is None or self.stopper.reason is None \
+                           else self.stopper.reason
 
         # write to vectors
         #if torch.cuda.device_count() > 1:
@@ -112,5 +307,146 @@ class Word2VecTrainer:
         #else:
             #self.skip_gram_model.save_embedding(self.data.id2word, output_file, self.data.max_num_words_file)
             
-        self.skip_gram_model.save_embedding(self.data.id2word, output_file, self.data.max_num_words_file)
+        self.saveEmbedding(output_file)
         return losses
+
+
+    # random split of the documents into training and held-out documents, the same for every run
+    def splitDocuments(self, num_documents, seed=12345):
+        order    = np.random.RandomState(seed).permutation(num_documents)
+        held_out = max(1, int(round(num_documents * self.validation_fraction)))
+        return np.sort(order[held_out:]), np.sort(order[0:held_out])
+
+
+    # fixed set of evaluation batches (pairs and negatives) drawn once from the held-out documents
+    def evaluationBatches(self, training_files, documents):
+
+        dataset = self.initDataset(training_files, documents)
+        dataset.setEpoch(0)
+
+        # shared negatives are weighted like in training, so both losses are on the same scale
+        self.eval_neg_weight = dataset.neg_weight
+
+        batches   = list()
+        examples  = list()
+        num_pairs = 0
+
+        for pairs in dataset:
+            examples.append(pairs)
+            if len(examples) == self.batch_size:
+                batches.append(dataset.collate(examples))
+                num_pairs += len(batches[-1][-2])
+                examples   = list()
+            if num_pairs >= self.num_eval_pairs:
+                break
+
+        if len(examples) > 0 and num_pairs < self.num_eval_pairs:
+            batches.append(dataset.collate(examples))
+
+        return [batch for batch in batches if len(batch[-2]) > 0]
+
+
+    # mean loss per pair on the evaluation batches
+    def evaluate(self, batches):
+
+        total = torch.zeros((), device=self.device)
+        count = 0
+
+        with torch.no_grad():
+            for batch in batches:
+                batch  = [tensor.to(self.device, non_blocking=True) for tensor in batch]
+                total += self.skip_gram_model.forward(*batch, self.eval_neg_weight) * len(batch[-2])
+                count += len(batch[-2])
+
+        return total.item() / max(count, 1)
+
+
+    # stopping reason and epoch for the results csv
+    def stopNote(self):
+        return "stopped after epoch {}: {}".format(self.stop_epoch, self.stop_reason)
+
+
+    # continue a run that was interrupted; the trainer has to be created with the same settings and documents
+    def resume(self, training_files, output_file, checkpoint_path, num_epochs=100):
+        return self.train(training_files, output_file, num_epochs=num_epochs, resume_path=checkpoint_path)
+
+
+    # checkpoint with everything needed to continue after the given number of finished epochs
+    def saveCheckpoint(self, optimizer, scheduler, epoch, losses):
+
+        # one write at a time, so an older checkpoint can never replace a newer one
+        self.joinCheckpoint()
+
+        state = {'model':          self.skip_gram_model.state_dict(),
+                 'optimizer':      optimizer.state_dict(),
+                 'scheduler':      scheduler.state_dict(),
+                 'rng':            rngState(),
+                 'epoch':          epoch,
+                 'losses':         list(losses),
+                 'iter_per_epoch': self.iter_per_epoch,
+                 'emb_size':       self.emb_size,
+                 'early_stopping': None if self.stopper is None else dict(vars(self.stopper))}
+
+        self.checkpoint_thread = saveCheckpoint(self.checkpoint_path, state, background=self.background_checkpoint)
+
+
+    def joinCheckpoint(self):
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
+
+
+    # restore model, optimizer, scheduler and random number generators, returns the next epoch and the loss history
+    def restoreCheckpoint(self, checkpoint_path, optimizer, scheduler):
+
+        state = readCheckpoint(checkpoint_path, self.device)
+
+        if state['emb_size'] != self.emb_size:
+            raise ValueError("Checkpoint has {} embeddings, the trainer {}".format(state['emb_size'], self.emb_size))
+
+        self.skip_gram_model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        scheduler.load_state_dict(state['scheduler'])
+        setRngState(state['rng'])
+
+        self.iter_per_epoch = state['iter_per_epoch']
+
+        if self.stopper is not None and state['early_stopping'] is not None:
+            vars(self.stopper).update(state['early_stopping'])
+
+        return state['epoch'], state['losses']
+
+
+    # incremental training when new documents arrive: the trainer is created on the new documents only, the model
+    # saved with saveModel is extended by their words and trained on them for num_passes epochs
+    def update(self, new_files, output_file, model_path, num_passes=1):
+        return self.train(new_files, output_file, num_epochs=num_passes, init=weightInit.inherit, model_path=model_path)
+
+
+    # train word2vec model with lock-free updates from several processes on CPU
+    def trainHogwild(self, training_files, output_file, num_epochs=100, num_processes=4,
+                     init=weightInit.fromScratch, model_path=None):
+
+        self.weightInitialisation(init, saved_model_path=model_path)
+
+        dataset = self.initDataset(training_files)
+
+        losses = trainHogwild(self.skip_gram_model, dataset, num_epochs, num_processes, self.batch_size, self.initial_lr)
+        self.iter_per_epoch = dataset.num_files
+
+        # hogwild training has no held-out loss and always runs all epochs
+        self.stop_epoch  = len(losses)
+        self.stop_reason = "completed all epochs"
+
+        self.saveEmbedding(output_file)
+        return losses
+
+
+    # export the embedding; with background_export the file is written by a thread that can be joined through
+    # self.export_thread, the interpreter waits for it before exiting
+    def saveEmbedding(self, output_file):
+        self.export_thread = self.skip_gram_model.save_embedding(self.data.id2word, output_file,
+                                                                 self.data.max_num_words_file,
+                                                                 binary=self.binary_export,
+                                                                 background=self.background_export,
+                                                                 keyword_channel=self.keyword_channel)
@@ -0,0 +1,83 @@
+import os
+import json
+
+''' Streaming word counter with bounded memory. Words are counted in the order they are first seen. If a maximum
+    vocabulary size is given, the counter never holds more than PRUNE_FACTOR times that many words: as soon as the
+    table grows beyond that, every word seen at most min_reduce times is dropped and min_reduce is raised by one,
+    as in the original word2vec implementation. Rare words may therefore be dropped while counting, and the counts
+    of surviving words are lower bounds.
+'''
+
+PRUNE_FACTOR = 2
+
+# the vocabulary of a saved model is stored next to its state dict
+VOCABULARY_EXTENSION = '.vocab.json'
+
+
+class VocabularyCounter:
+
+    def __init__(self, max_vocab_size=None):
+
+        self.max_vocab_size = max_vocab_size
+        self.prune_size     = None if max_vocab_size is None else max(1, max_vocab_size * PRUNE_FACTOR)
+        self.min_reduce     = 1
+
+        self.word_frequency = dict()
+        self.token_count    = 0
+
+
+    def __len__(self):
+        return len(self.word_frequency)
+
+
+    # count the words of a single document or line
+    def add(self, words):
+
+        word_frequency = self.word_frequency
+        for word in words:
+            word_frequency[word] = word_frequency.get(word, 0) + 1
+
+        self.token_count += len(words)
+
+        if self.prune_size is not None and len(word_frequency) > self.prune_size:
+            self.prune()
+
+
+    # drop the rarest words until the table fits into its budget again
+    def prune(self):
+        while len(self.word_frequency) > self.max_vocab_size:
+            self.word_frequency = {w: c for w, c in self.word_frequency.items() if c > self.min_reduce}
+            self.min_reduce += 1
+
+
+    # words with at least min_count occurrences in order of first occurrence, limited to the most frequent ones
+    def vocabulary(self, min_count=1):
+
+        words = [(w, c) for w, c in self.word_frequency.items() if c >= min_count]
+
+        if self.max_vocab_size is not None and len(words) > self.max_vocab_size:
+            keep  = sorted(range(len(words)), key=lambda i: -words[i][1])[0:self.max_vocab_size]
+            words = [words[i] for i in sorted(keep)]
+
+        return words
+
+
+# write the vocabulary of a training session in id order, together with the counts needed to continue training
+def writeVocabulary(path, words, frequency, token_count, max_num_words_file):
+
+    with open(path + '.tmp', 'w', encoding="utf8") as f:
+        json.dump({'words':              list(words),
+                   'frequency':          [int(c) for c in frequency],
+                   'token_count':        int(token_count),
+                   'max_num_words_file': int(max_num_words_file)}, f)
+
+    os.replace(path + '.tmp', path)
+
+
+# returns words, frequency, token_count and max_num_words_file of a saved vocabulary
+def readVocabulary(path):
+
+    with open(path, encoding="utf8") as f:
+        vocab = json.load(f)
+
+    return vocab['words'], vocab['frequency'], vocab['token_count'], vocab['max_num_words_file']
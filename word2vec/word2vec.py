@@ -2,13 +2,65 @@ import torch
 import torch.nn as nn
 import numpy as np
 import torch.nn.functional as F
+import threading
 from torch.nn import init
+from utilities.vectorStore import writeVectorsText, writeVectorStore, writeKeywordIds, removeKeywordIds
+from utilities.subword import subwordTable, writeSubwordBuckets, MIN_N, MAX_N
+from word2vec.huffman import huffmanCodes
 
 """
     u_embedding: Embedding for center word.
     v_embedding: Embedding for neighbor words.
 """
 
+# negative sampling loss of a batch of input vectors emb_u [B, D], their targets emb_v [B, D] and the negatives,
+# either [B, N, D] per pair or [K, D] shared by the whole batch
+# (neg_weight is annotated, TorchScript would otherwise take it for a tensor)
+def negativeSamplingLoss(emb_u, emb_v, emb_neg_v, neg_weight: float = 1.0):
+
+    score = torch.sum(torch.mul(emb_u, emb_v), dim=1)
+    score = torch.clamp(score, max=10, min=-10)
+    score = -F.logsigmoid(score)
+
+    if emb_neg_v.dim() == 2:
+        neg_score = torch.matmul(emb_u, emb_neg_v.t())
+    else:
+        neg_score = torch.bmm(emb_neg_v, emb_u.unsqueeze(2)).squeeze(2)
+    neg_score = torch.clamp(neg_score, max=10, min=-10)
+    neg_score = -torch.sum(F.logsigmoid(-neg_score), dim=1)
+
+    return torch.mean(score + neg_weight * neg_score)
+
+
+# hierarchical softmax loss: binary logistic loss of the input vectors emb_u [B, D] at every inner node emb_nodes
+# [B, L, D] on the path of the target word, codes are the branches taken and mask hides the padding of short paths
+def hierarchicalSoftmaxLoss(emb_u, emb_nodes, codes, mask):
+
+    score = torch.bmm(emb_nodes, emb_u.unsqueeze(2)).squeeze(2)
+    score = torch.clamp(score, max=10, min=-10)
+    score = -F.logsigmoid((1.0 - 2.0 * codes) * score) * mask
+
+    return torch.mean(torch.sum(score, dim=1))
+
+
+# fuse the elementwise ops of a loss function into a few kernels; torch.compile where available, TorchScript on
+# older versions of torch. Batch sizes vary from step to step, so shapes are compiled as dynamic.
+def compileFunction(function):
+    if hasattr(torch, 'compile'):
+        return torch.compile(function, dynamic=True)
+    return torch.jit.script(function)
+
+
+# write an exported dictionary and its keyword channel; an export without keyword channel removes the one of an earlier
+# export, the keywords are part of the vectors again
+def writeEmbedding(writer, file_name, words, matrix, max_num_words_file, keyword_ids):
+    writer(file_name, words, matrix, max_num_words_file)
+    if keyword_ids is None:
+        removeKeywordIds(file_name)
+    else:
+        writeKeywordIds(file_name, keyword_ids)
+
+
 class SkipGramModel(nn.Module):
 
     def __init__(self, keyword_path, emb_size, emb_dimension):
@@ -19,50 +71,88 @@ class SkipGramModel(nn.Module):
         self.emb_dimension = emb_dimension
         self.u_embeddings  = nn.Embedding(emb_size, emb_dimension, sparse=True)
         self.v_embeddings  = nn.Embedding(emb_size, emb_dimension, sparse=True)
+        self.loss          = negativeSamplingLoss
         self.weight_init()
 
 
     # run vector through word2vec shallow neural network
-    def forward(self, pos_u, pos_v, neg_v):
-        emb_u = self.u_embeddings(pos_u)
+    # neg_v is either [B, N] (own negatives for every pair) or [K] (one pool of negatives shared by the whole batch)
+    def forward(self, pos_u, pos_v, neg_v, neg_weight=1.0):
+        emb_u = self.inputEmbeddings(pos_u)
         emb_v = self.v_embeddings(pos_v)
         emb_neg_v = self.v_embeddings(neg_v)
 
-        score = torch.sum(torch.mul(emb_u, emb_v), dim=1)
-        score = torch.clamp(score, max=10, min=-10)
-        score = -F.logsigmoid(score)
+        return self.loss(emb_u, emb_v, emb_neg_v, neg_weight)
 
-        neg_score = torch.bmm(emb_neg_v, emb_u.unsqueeze(2)).squeeze()
-        neg_score = torch.clamp(neg_score, max=10, min=-10)
-        neg_score = -torch.sum(F.logsigmoid(-neg_score), dim=1)
 
-        return torch.mean(score + neg_score)
+    # input vectors of a batch of centre words
+    def inputEmbeddings(self, pos_u):
+        return self.u_embeddings(pos_u)
 
 
-    # save the hidden layer values for every vector
-    def save_embedding(self, id2word, file_name, max_num_words_file):
-    
-        embedding = self.u_embeddings.weight.cpu().data.numpy() 
-        padding   = np.zeros((self.num_keywords,), dtype=float)  
-        
-        with open(file_name, 'w') as f:
-        
-            f.write('%d %d %d\n' % (len(id2word), self.emb_dimension + self.num_keywords, max_num_words_file))
-    
-            for wid, w in id2word.items():       
-            
-                e = None    
-                   
-                if w in self.keywords:
-                    key_vec        = np.zeros((self.emb_dimension + self.num_keywords,), dtype=float)   
-                    index          = self.emb_dimension + self.keywords[w]
-                    key_vec[index] = 1.0
-                    e = ' '.join(map(lambda x: str(x), key_vec))
-                else:  
-                    word_vec = np.concatenate((embedding[wid], padding), axis=None)
-                    e        = ' '.join(map(lambda x: str(x), word_vec))
-                                        
-                f.write('%s %s\n' % (w, e))     
+    # input vectors of the whole vocabulary as exported to the dictionary
+    def inputVectors(self):
+        return self.u_embeddings.weight.detach().cpu().numpy()
+
+
+    # compiled execution of the loss; the embedding lookups stay eager because their gradients are sparse
+    def compileLoss(self):
+        self.loss = compileFunction(self.loss)
+
+
+    # save the hidden layer values for every vector, keywords are replaced by one-hot vectors behind the embedding;
+    # with keyword_channel the dictionary holds only the embedding and the keyword ids are written next to it
+    def save_embedding(self, id2word, file_name, max_num_words_file, binary=False, background=False,
+                       keyword_channel=False):
+
+        words, matrix = self.embeddingMatrix(id2word, keyword_channel)
+        keyword_ids   = self.keywordIds(words) if keyword_channel else None
+
+        writer = writeVectorStore if binary else writeVectorsText
+        if not background:
+            writeEmbedding(writer, file_name, words, matrix, max_num_words_file, keyword_ids)
+            return None
+
+        # the matrix is a copy of the weights, training can continue while the file is written
+        thread = threading.Thread(target=writeEmbedding, args=(writer, file_name, words, matrix, max_num_words_file,
+                                                               keyword_ids))
+        thread.start()
+        return thread
+
+
+    # full export matrix: embedding followed by num_keywords zeros, keyword rows hold only their one-hot entry; with
+    # keyword_channel only the embedding, keyword rows are zero
+    def embeddingMatrix(self, id2word, keyword_channel=False):
+
+        wids  = np.fromiter(id2word.keys(), dtype=np.int64, count=len(id2word))
+        words = list(id2word.values())
+
+        num_columns = self.emb_dimension if keyword_channel else self.emb_dimension + self.num_keywords
+
+        matrix = np.zeros((len(words), num_columns), dtype=np.float32)
+        matrix[:, 0:self.emb_dimension] = self.inputVectors()[wids]
+
+        rows    = [row for row, w in enumerate(words) if w in self.keywords]
+        columns = [self.emb_dimension + self.keywords[words[row]] for row in rows]
+
+        matrix[rows] = 0.0
+        if not keyword_channel:
+            matrix[rows, columns] = 1.0
+
+        return words, matrix
+
+
+    # keyword id of every word, -1 for words that are no keyword
+    def keywordIds(self, words):
+        return np.array([self.keywords.get(word, -1) for word in words], dtype=np.int32)
+
+
+    # copy the rows of the first num_words words from the state dict of a smaller model, rows of words that were added
+    # to the vocabulary since keep their initial values
+    def inheritState(self, state_dict, num_words):
+        with torch.no_grad():
+            self.u_embeddings.weight[0:num_words] = state_dict['u_embeddings.weight'][0:num_words]
+            self.v_embeddings.weight[0:num_words] = state_dict['v_embeddings.weight'][0:num_words]
 
 
     # initialise (or refresh) weights
@@ -72,7 +162,9 @@ class SkipGramModel(nn.Module):
         init.constant_(self.v_embeddings.weight.data, 0)
         
         
-    def readKeywords(self, keywords_file):
+    # keyword of every line of the keyword file and its id, the line number from 0
+    @staticmethod
+    def readKeywords(keywords_file):
         keywords = dict()
         index = 0
         for line in open(keywords_file, encoding="utf8"):
@@ -80,3 +172,119 @@ class SkipGramModel(nn.Module):
             index += 1
         return keywords
 
+
+"""
+    u_embedding: Embedding for center word.
+    v_embedding: Embedding for the inner nodes of the Huffman tree (hierarchical softmax).
+"""
+
+class HierarchicalSkipGramModel(SkipGramModel):
+
+    def __init__(self, keyword_path, emb_size, emb_dimension, frequencies):
+        super(HierarchicalSkipGramModel, self).__init__(keyword_path, emb_size, emb_dimension)
+
+        points, codes, mask = huffmanCodes(frequencies)
+        self.register_buffer('points', torch.from_numpy(points))
+        self.register_buffer('codes',  torch.from_numpy(codes))
+        self.register_buffer('mask',   torch.from_numpy(mask))
+
+        # V-1 inner nodes replace the V output vectors
+        self.v_embeddings = nn.Embedding(max(1, emb_size - 1), emb_dimension, sparse=True)
+        self.loss         = hierarchicalSoftmaxLoss
+        self.weight_init()
+
+
+    # the Huffman tree is rebuilt from the merged frequencies, so its inner nodes start again from zero
+    def inheritState(self, state_dict, num_words):
+        with torch.no_grad():
+            self.u_embeddings.weight[0:num_words] = state_dict['u_embeddings.weight'][0:num_words]
+
+
+    # binary logistic loss along the path of every context word, neg_v is not used
+    def forward(self, pos_u, pos_v, neg_v=None, neg_weight=1.0):
+        emb_u     = self.inputEmbeddings(pos_u)
+        emb_nodes = self.v_embeddings(self.points[pos_v])
+
+        return self.loss(emb_u, emb_nodes, self.codes[pos_v], self.mask[pos_v])
+
+
+"""
+    u_embedding: Embedding bag averaging the context words of a window (input vectors, exported as before).
+    v_embedding: Embedding for the predicted center word.
+"""
+
+class CBOWModel(SkipGramModel):
+
+    def __init__(self, keyword_path, emb_size, emb_dimension):
+        super(CBOWModel, self).__init__(keyword_path, emb_size, emb_dimension)
+
+        # same weight layout as nn.Embedding, so save_embedding and weight_init are unchanged
+        self.u_embeddings = nn.EmbeddingBag(emb_size, emb_dimension, mode='mean', sparse=True)
+        self.weight_init()
+
+
+    # context is the flat list of context words of the batch, offsets the start of every window within it;
+    # all windows are averaged by a single gather
+    def forward(self, context, offsets, pos_v, neg_v, neg_weight=1.0):
+        emb_u = self.u_embeddings(context, offsets)
+        emb_v = self.v_embeddings(pos_v)
+        emb_neg_v = self.v_embeddings(neg_v)
+
+        return self.loss(emb_u, emb_v, emb_neg_v, neg_weight)
+
+
+"""
+    u_embedding: Embedding bag over hashed character n-gram buckets, a word is the mean of its n-grams.
+    v_embedding: Embedding for neighbor words.
+"""
+
+class SubwordSkipGramModel(SkipGramModel):
+
+    def __init__(self, keyword_path, emb_size, emb_dimension, words, num_buckets, min_n=MIN_N, max_n=MAX_N):
+        super(SubwordSkipGramModel, self).__init__(keyword_path, emb_size, emb_dimension)
+
+        self.num_buckets = num_buckets
+        self.min_n       = min_n
+        self.max_n       = max_n
+
+        # derived from the vocabulary, so they are not part of the saved state
+        ids, starts, lengths = subwordTable(words, num_buckets, min_n, max_n)
+        self.register_buffer('subword_ids',     torch.from_numpy(ids),     persistent=False)
+        self.register_buffer('subword_starts',  torch.from_numpy(starts),  persistent=False)
+        self.register_buffer('subword_lengths', torch.from_numpy(lengths), persistent=False)
+
+        # the input table has num_buckets rows however large the vocabulary grows
+        self.u_embeddings = nn.EmbeddingBag(num_buckets, emb_dimension, mode='mean', sparse=True)
+        self.weight_init()
+
+
+    # gather the n-gram buckets of all centre words of the batch and average them in one embedding bag call
+    def inputEmbeddings(self, pos_u):
+        lengths = self.subword_lengths[pos_u]
+        offsets = torch.cumsum(lengths, dim=0) - lengths
+        index   = torch.repeat_interleave(self.subword_starts[pos_u] - offsets, lengths)
+        index   = index + torch.arange(len(index), device=index.device)
+
+        return self.u_embeddings(self.subword_ids[index], offsets)
+
+
+    # the buckets do not depend on the vocabulary and are copied as a whole
+    def inheritState(self, state_dict, num_words):
+        with torch.no_grad():
+            self.u_embeddings.weight.copy_(state_dict['u_embeddings.weight'])
+            self.v_embeddings.weight[0:num_words] = state_dict['v_embeddings.weight'][0:num_words]
+
+
+    def inputVectors(self, chunk_size=65536):
+        with torch.no_grad():
+            wids = torch.arange(self.emb_size, device=self.subword_ids.device)
+            return torch.cat([self.inputEmbeddings(chunk) for chunk in torch.split(wids, chunk_size)]).cpu().numpy()
+
+
+    # the word vectors are exported as usual, the bucket matrix is written next to them for unseen words
+    def save_embedding(self, id2word, file_name, max_num_words_file, binary=False, background=False,
+                       keyword_channel=False):
+        writeSubwordBuckets(file_name, self.u_embeddings.weight.detach().cpu().numpy(), self.min_n, self.max_n)
+        return super(SubwordSkipGramModel, self).save_embedding(id2word, file_name, max_num_words_file,
+                                                                binary=binary, background=background,
+                                                                keyword_channel=keyword_channel)